@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+# make the ETL scripts importable when running from anywhere
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import main as etl
+from scripts.utils_dag import run
+from synthetic_data import generate
+
+
+########################## ETL scale-out benchmark ############################
+# run every ETL stage on synthetic inputs of growing size (more canteens, more years)
+# and record the time, memory and rows of each stage to locate the scaling knees
+
+# (canteens, years) of each scale, the real extract is about (100, 9)
+SCALES = [(100, 9), (300, 9), (1000, 9), (100, 27), (100, 50)]
+
+
+def run_scale(n_canteens, n_years, workers, trace_memory, seed):
+    """ generate the inputs of a scale in a scratch directory and run the whole ETL on them """
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        n_rows = generate(root, n_canteens, n_years=n_years, seed=seed)
+
+        # the ETL reads ../data and writes into data, relative to the ETL directory
+        (Path(root) / 'ETL' / 'data').mkdir(parents=True)
+        os.chdir(Path(root) / 'ETL')
+        try:
+            _, metrics = run(etl.STAGES, workers=workers, trace_memory=trace_memory)
+        finally:
+            os.chdir(cwd)
+
+    return n_rows, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ETL stages on synthetic data.')
+    parser.add_argument('--scales', nargs='+', default=None, metavar='CANTEENSxYEARS',
+                        help='scales to run, e.g. 100x9 1000x50 (default: {})'.format(
+                            ' '.join('{}x{}'.format(*scale) for scale in SCALES)))
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes running the stages (default 1, so that stages do not compete)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also record the peak memory allocated by each stage')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='write all the metrics to this JSON file')
+    args = parser.parse_args()
+
+    scales = [tuple(int(n) for n in scale.split('x')) for scale in args.scales] if args.scales else SCALES
+
+    results = {}
+    for n_canteens, n_years in scales:
+        name = '{}x{}'.format(n_canteens, n_years)
+        n_rows, metrics = run_scale(n_canteens, n_years, args.workers, args.trace_memory, args.seed)
+        results[name] = {'canteens': n_canteens, 'years': n_years, 'attendance_rows': n_rows, 'stages': metrics}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    # one column per scale, wall time and peak memory of each stage
+    shown = ['wall_time', 'peak_rss_mb', 'rss_increase_mb'] + (['tracemalloc_peak_mb'] if args.trace_memory else [])
+    for metric in shown:
+        table = pd.DataFrame({name: pd.Series({stage: m[metric] for stage, m in result['stages'].items()})
+                              for name, result in results.items()})
+        table.loc['attendance rows'] = [result['attendance_rows'] for result in results.values()]
+        print('\n' + metric)
+        print(table.to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# make the ETL scripts importable when running from anywhere
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from scripts.utils_intervals import in_intervals, interval_left_join
+
+
+########################## Interval join benchmark ############################
+# compare the legacy cross join interval labelling with the sorted interval lookup
+# at today's calendar size (~10 years of days, ~60 holidays) and at 10x and 100x
+
+# the legacy path materializes days x intervals rows, above that it is not even tried
+CROSS_JOIN_MAX_ROWS = 50_000_000
+
+# longest distinct daily calendar generated (~90 years)
+MAX_DAYS = 33_000
+
+
+def make_calendar(scale):
+    """ generate days and non overlapping intervals, scale times today's size """
+
+    n_rows = 3300 * scale
+    n_intervals = 56 * scale
+
+    # nanosecond timestamps cannot span more than ~580 years, so past 90 years of
+    # history the extra rows are repeated days, as if several calendars were stacked
+    n_days = min(n_rows, MAX_DAYS)
+    calendar = pd.date_range('1950-01-01', periods=n_days, freq='D')
+    days = pd.DataFrame({'date': np.repeat(calendar.values, n_rows // n_days)})
+
+    # spread the intervals evenly on the calendar, each lasting up to 10 days
+    rng = np.random.default_rng(42)
+    step = n_days // n_intervals
+    starts = calendar.values[::step][:n_intervals]
+    lengths = rng.integers(0, min(step, 10), size=len(starts))
+    intervals = pd.DataFrame({
+        'vacances_nom': ['vacances_' + str(i) for i in range(len(starts))],
+        'date_debut': starts,
+        'date_fin': starts + lengths.astype('timedelta64[D]'),
+    })
+
+    return days, intervals
+
+
+def cross_join_label(days, intervals):
+    """ legacy interval left join simulated with a cross join on a temp key """
+
+    df = days.copy()
+    intervals = intervals.copy()
+    df['temp_key'] = 1
+    intervals['temp_key'] = 1
+    crossjoindf = pd.merge(df, intervals, on=['temp_key'])
+    df.drop(columns=['temp_key'], inplace=True)
+    crossjoindf.drop(columns=['temp_key'], inplace=True)
+
+    conditionnal_df = crossjoindf[
+        (crossjoindf['date'] >= crossjoindf['date_debut']) & (crossjoindf['date'] <= crossjoindf['date_fin'])]
+    conditionnal_df = conditionnal_df.set_index(['date'])
+
+    return df.merge(conditionnal_df, left_on=['date'], right_index=True, how='left')
+
+
+def sorted_lookup_label(days, intervals):
+    """ new interval left join relying on sorted bounds and binary search """
+
+    return interval_left_join(days, 'date', intervals, 'date_debut', 'date_fin')
+
+
+def sorted_lookup_mask(days, intervals):
+    """ membership only, as used by the holidays distance features """
+
+    return in_intervals(days['date'], intervals['date_debut'], intervals['date_fin'])
+
+
+def measure(func, *args):
+    """ return wall time in seconds and peak traced memory in MB of a call """
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak / 1024 ** 2
+
+
+def main():
+    print(f"{'scale':>6} {'rows':>9} {'intervals':>9} {'method':>14} {'time (s)':>10} {'peak (MB)':>10}")
+
+    for scale in [1, 10, 100]:
+        days, intervals = make_calendar(scale)
+
+        methods = [('sorted_lookup', sorted_lookup_label), ('sorted_mask', sorted_lookup_mask)]
+        if len(days) * len(intervals) <= CROSS_JOIN_MAX_ROWS:
+            methods.insert(0, ('cross_join', cross_join_label))
+        else:
+            print(f"{scale:>6} {len(days):>9} {len(intervals):>9} {'cross_join':>14} "
+                  f"skipped, would materialize {len(days) * len(intervals):,} rows")
+
+        for name, func in methods:
+            elapsed, peak = measure(func, days, intervals)
+            print(f"{scale:>6} {len(days):>9} {len(intervals):>9} {name:>14} {elapsed:>10.4f} {peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
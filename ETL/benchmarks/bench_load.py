@@ -0,0 +1,120 @@
+import sqlite3 as sql
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# make the ETL scripts importable when running from anywhere
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import load
+
+
+########################## Datawarehouse load benchmark ############################
+# compare the legacy load (index created first, to_sql with default batches and journaling,
+# cell by cell conversions) with the bulk-load path of load.py on synthetic warehouses
+
+N_SITES = 200
+
+TEMPORAL_COLUMNS = ['vacances_dans', 'depuis_vacances', 'ferie_dans', 'depuis_ferie',
+                    'chretiennes_dans', 'depuis_chretiennes', 'juives_dans', 'depuis_juives',
+                    'ramadan_dans', 'depuis_ramadan', 'musulmanes_dans', 'depuis_musulmanes']
+
+EVENT_COLUMNS = ['chretiennes', 'juives', 'ramadan', 'musulmanes', 'greve']
+
+
+def make_tables(n_days, rng):
+    """ synthetic fact and dimension tables shaped like the datawarehouse ones """
+
+    dates = pd.date_range('2000-01-03', periods=n_days, freq='D')
+    fact = pd.DataFrame({
+        'jour_id': np.repeat(np.arange(1, n_days + 1), N_SITES),
+        'site_id': np.tile(np.arange(1, N_SITES + 1), n_days),
+        'date': np.repeat(dates, N_SITES),
+        'prevision': rng.integers(50, 200, n_days * N_SITES).astype(float),
+    })
+    fact['reel'] = fact['prevision'] - rng.integers(0, 20, len(fact))
+
+    sites = pd.DataFrame({
+        'site_id': np.arange(1, N_SITES + 1),
+        'site_type': 'M/E',
+        'cantine_nom': ['cantine {}'.format(i) for i in range(N_SITES)],
+        'annee_scolaire': '2018-2019',
+        'effectif': rng.integers(50, 500, N_SITES),
+        'longitude': rng.random(N_SITES),
+        'latitude': rng.random(N_SITES),
+    })
+
+    days = pd.DataFrame({'jour_id': np.arange(1, n_days + 1), 'date': dates})
+    menus = days.assign(plats=['plat {}'.format(i % 300) for i in range(n_days)])
+    temporal = days.assign(**{col: rng.integers(0, 100, n_days) for col in TEMPORAL_COLUMNS})
+    events = days.assign(**{col: rng.integers(0, 2, n_days) for col in EVENT_COLUMNS})
+
+    return {'Frequentation_quotidienne': fact, 'Dim_site': sites, 'Dim_menu': menus,
+            'Dim_temporelle': temporal, 'Dim_evenement': events}
+
+
+def legacy_load(path, tables):
+    """ legacy path: index before the inserts, to_sql and row-wise conversions, default pragmas """
+
+    conn = sql.connect(path)
+    load.create_tables(conn)
+    load.create_indexes(conn)
+    conn.commit()
+
+    tables['Frequentation_quotidienne'].to_sql('Frequentation_quotidienne', conn, if_exists='append', index=False)
+    for table, df in tables.items():
+        if table == 'Frequentation_quotidienne':
+            continue
+        df = df.copy()
+        for col in df.select_dtypes(include='datetime').columns:
+            df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+        rows = df.astype(object).where(df.notnull(), None).values.tolist()
+        columns = ', '.join('`{}`'.format(col) for col in df.columns)
+        placeholders = ', '.join('?' * len(df.columns))
+        conn.executemany('INSERT OR REPLACE INTO `{}` ({}) VALUES ({});'.format(table, columns, placeholders), rows)
+        conn.commit()
+    conn.close()
+
+
+def bulk_load(path, tables):
+    """ bulk-load path: pragmas, one transaction, typed executemany, indexes last, ANALYZE """
+
+    conn = sql.connect(path, isolation_level=None)
+    load.set_pragmas(conn, load.BULK_PRAGMAS)
+    conn.execute('BEGIN')
+    load.create_tables(conn)
+    load.insert_rows(conn, 'Frequentation_quotidienne', tables['Frequentation_quotidienne'])
+    for table, df in tables.items():
+        if table != 'Frequentation_quotidienne':
+            load.upsert(conn, table, df)
+    load.create_indexes(conn)
+    conn.execute('COMMIT')
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def main():
+    rng = np.random.default_rng(42)
+    print(f"{'fact rows':>10} {'legacy (s)':>11} {'bulk (s)':>9} {'speedup':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_days in [500, 2500, 10000]:
+            tables = make_tables(n_days, rng)
+
+            timings = []
+            for name, loader in [('legacy', legacy_load), ('bulk', bulk_load)]:
+                path = str(Path(tmp) / '{}_{}.db'.format(name, n_days))
+                start = time.perf_counter()
+                loader(path, tables)
+                timings.append(time.perf_counter() - start)
+
+            n_rows = len(tables['Frequentation_quotidienne'])
+            print(f"{n_rows:>10} {timings[0]:>11.3f} {timings[1]:>9.3f} {timings[0] / timings[1]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
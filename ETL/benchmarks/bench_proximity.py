@@ -0,0 +1,66 @@
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# make the ETL scripts importable when running from anywhere
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from scripts.utils_proximity import event_proximity
+
+
+########################## Event proximity benchmark ############################
+# compare the legacy list comprehension distances with the vectorized engine
+# on daily calendars from one decade up to a century, for the 6 event calendars
+
+N_EVENTS = 6
+
+# the legacy path is quadratic, above that horizon it is not even tried
+LEGACY_MAX_DAYS = 5000
+
+
+def legacy_proximity(flags):
+    """ legacy per event column computation: while loop on runs + nested comprehensions """
+
+    for col in range(flags.shape[1]):
+        events_index = np.where(flags[:, col])[0]
+        events_min_index = []
+        events_max_index = []
+        i = 0
+        while i < len(events_index):
+            j = 0
+            while i + j < len(events_index) and (events_index[i] + j) == events_index[i + j]:
+                j += 1
+            events_min_index.append(events_index[i])
+            events_max_index.append(events_index[i + j - 1])
+            i += j
+
+        indexes = range(0, len(flags))
+        [min([i - x for i in events_min_index if i > x], default=0) for x in indexes]
+        [min([x - i for i in events_max_index if i < x], default=0) for x in indexes]
+
+
+def main():
+    rng = np.random.default_rng(42)
+    print(f"{'years':>6} {'days':>7} {'legacy (s)':>11} {'vectorized (s)':>15}")
+
+    for years in [10, 30, 100]:
+        n_days = 365 * years
+        flags = rng.random((n_days, N_EVENTS)) < 0.03
+
+        legacy = '-'
+        if n_days <= LEGACY_MAX_DAYS:
+            start = time.perf_counter()
+            legacy_proximity(flags)
+            legacy = f"{time.perf_counter() - start:.4f}"
+
+        start = time.perf_counter()
+        event_proximity(flags)
+        vectorized = time.perf_counter() - start
+
+        print(f"{years:>6} {n_days:>7} {legacy:>11} {vectorized:>15.4f}")
+
+
+if __name__ == "__main__":
+    main()
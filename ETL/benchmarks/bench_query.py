@@ -0,0 +1,103 @@
+import argparse
+import sqlite3 as sql
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# make the ETL scripts importable when running from anywhere
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import load
+from bench_load import N_SITES, bulk_load, make_tables
+
+
+########################## Training query benchmark ############################
+# time the star join read by the training at scaled-up row counts, with the legacy
+# date index only and with the indexes matching the access paths
+
+REPEATS = 3
+
+
+def queries(conn, n_days):
+    """ training queries over the synthetic warehouse: whole history, a month, some canteens over all or a month """
+
+    middle = np.datetime64('2000-01-03') + n_days // 2
+    month = [str(middle) + ' 00:00:00', str(middle + 30) + ' 00:00:00']
+    # canteen names are turned into site ids, as the training reads do
+    canteens = ['cantine {}'.format(i) for i in range(0, N_SITES, N_SITES // 5)]
+    sites = [site_id for site_id, in conn.execute('SELECT site_id FROM Dim_site WHERE cantine_nom IN ({})'.format(
+        ', '.join('?' * len(canteens))), canteens)]
+    in_sites = load.SITES.format(', '.join('?' * len(sites)))
+
+    return {
+        'history': (load.PLAN_CHECKS['history'][0], []),
+        'month': (load.TRAINING_QUERY.format('WHERE ' + load.DATE_RANGE), month),
+        '5 canteens': (load.TRAINING_QUERY.format('WHERE ' + in_sites), sites),
+        'month of 5 canteens': (load.TRAINING_QUERY.format('WHERE {} AND {}'.format(load.DATE_RANGE, in_sites)),
+                                month + sites),
+    }
+
+
+def legacy_indexes(conn):
+    """ index set of the previous builds: the fact table date only """
+
+    for name in load.INDEXES:
+        conn.execute('DROP INDEX `{}`;'.format(name))
+    conn.execute('CREATE INDEX date ON Frequentation_quotidienne(date);')
+    conn.execute('ANALYZE')
+
+
+def time_query(conn, query, params):
+    """ best wall time of the query over a few runs, with its row count and plan """
+
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        rows = conn.execute(query, params).fetchall()
+        best = min(best, time.perf_counter() - start)
+
+    plan = [detail for _, _, _, detail in conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+    return best, len(rows), plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the training queries of the datawarehouse.')
+    parser.add_argument('--days', type=int, nargs='+', default=[500, 2500, 10000],
+                        help='days of the synthetic warehouses, with {} sites each'.format(N_SITES))
+    parser.add_argument('--plans', action='store_true', help='print the query plans')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    print(f"{'fact rows':>10} {'query':<20} {'rows':>8} {'legacy (s)':>11} {'indexed (s)':>12} {'speedup':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_days in args.days:
+            indexed_path = str(Path(tmp) / 'indexed_{}.db'.format(n_days))
+            bulk_load(indexed_path, make_tables(n_days, rng))
+            legacy_path = str(Path(tmp) / 'legacy_{}.db'.format(n_days))
+            with sql.connect(indexed_path) as source, sql.connect(legacy_path) as target:
+                source.backup(target)
+
+            indexed, legacy = sql.connect(indexed_path), sql.connect(legacy_path)
+            load.check_query_plans(indexed)
+            legacy_indexes(legacy)
+
+            n_rows = indexed.execute('SELECT COUNT(*) FROM Frequentation_quotidienne').fetchone()[0]
+            for name, (query, params) in queries(indexed, n_days).items():
+                legacy_time, n_selected, legacy_plan = time_query(legacy, query, params)
+                indexed_time, _, indexed_plan = time_query(indexed, query, params)
+                print(f"{n_rows:>10} {name:<20} {n_selected:>8} {legacy_time:>11.4f} {indexed_time:>12.4f} "
+                      f"{legacy_time / indexed_time:>7.1f}x")
+                if args.plans:
+                    print('    legacy:  ' + ' | '.join(legacy_plan))
+                    print('    indexed: ' + ' | '.join(indexed_plan))
+
+            indexed.close()
+            legacy.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+########################## Synthetic input data generator ############################
+# deterministic generator of every input CSV read by the ETL, in the layout of the real
+# Nantes extract, for any number of canteens and years of history: the ETL can be run
+# at scales the real data does not reach (see bench_etl.py)
+
+FRENCH_DAYS = ['Lun.', 'Mar.', 'Mer.', 'Jeu.', 'Ven.', 'Sam.', 'Dim.']
+FRENCH_MONTHS = ['Janvier', 'Février', 'Mars', 'Avril', 'Mai', 'Juin', 'Juillet',
+                 'Août', 'Septembre', 'Octobre', 'Novembre', 'Décembre']
+
+# school holidays of a school year: name, first day (month, day) and length in days
+HOLIDAYS = [('Vacances de la Toussaint', (10, 20), 11), ('Vacances de Noel', (12, 20), 15),
+            ("Vacances d'hiver", (2, 10), 16), ('Vacances de printemps', (4, 8), 16),
+            ("Vacances d'été", (7, 6), 57)]
+
+# fixed public holidays (month, day, name), a moving one is added around spring every year
+PUBLIC_HOLIDAYS = [(1, 1, "Jour de l'an"), (5, 1, 'Fête du travail'), (5, 8, 'Victoire des alliés'),
+                   (7, 14, 'Fête nationale'), (8, 15, 'Assomption'), (11, 1, 'Toussaint'),
+                   (11, 11, 'Armistice'), (12, 25, 'Noël')]
+
+# events per year of each religious calendar
+EVENTS_PER_YEAR = {'chretien': 45, 'juif': 11, 'musulman': 10}
+
+SCHOOL_TYPES = [('MATERNELLE', 'M'), ('ELEMENTAIRE', 'E')]
+
+DISH_WORDS = ['salade', 'carottes', 'râpées', 'poulet', 'rôti', 'bœuf', 'haché', 'poisson', 'pané',
+              'purée', 'pommes', 'terre', 'riz', 'pâtes', 'lentilles', 'haricots', 'verts', 'yaourt',
+              'fromage', 'blanc', 'compote', 'crème', 'dessert', 'tarte', 'gratin', 'courgettes', 'bio',
+              'sauce', 'tomate', 'quiche', 'lorraine', 'omelette', 'semoule', 'brocolis', 'fruit', 'saison']
+
+
+def _rng(seed, name):
+    # one independent stream per file: the content of a file only depends on its own parameters
+    return np.random.default_rng([seed] + [ord(c) for c in name])
+
+
+def _school_years(first_year, last_year):
+    years = np.arange(first_year, last_year + 1)
+    return pd.DataFrame({
+        'annee_scolaire': ['{}-{}'.format(y, y + 1) for y in years],
+        'date_debut': pd.to_datetime(['{}-09-01'.format(y) for y in years]),
+        'date_fin': pd.to_datetime(['{}-07-05'.format(y + 1) for y in years]),
+    })
+
+
+def _holidays(school_years):
+    rows = []
+    for year, label in zip(school_years['date_debut'].dt.year, school_years['annee_scolaire']):
+        for name, (month, day), length in HOLIDAYS:
+            start = pd.Timestamp(year if month >= 9 else year + 1, month, day)
+            rows.append((label, name, start, start + pd.Timedelta(days=length - 1), 'B', 1))
+
+    return pd.DataFrame(rows, columns=['annee_scolaire', 'vacances_nom', 'date_debut', 'date_fin', 'zone', 'vacances'])
+
+
+def _public_holidays(first_year, last_year, rng):
+    rows = [(pd.Timestamp(year, month, day), 1, name)
+            for year in range(first_year, last_year + 1) for month, day, name in PUBLIC_HOLIDAYS]
+    rows += [(pd.Timestamp(year, 3, 22) + pd.Timedelta(days=int(rng.integers(0, 35))), 1, 'Lundi de Pâques')
+             for year in range(first_year, last_year + 1)]
+
+    return pd.DataFrame(rows, columns=['date', 'jour_ferie', 'nom_jour_ferie']).sort_values('date')
+
+
+def _random_days(first_year, last_year, per_year, rng):
+    days = pd.date_range('{}-01-01'.format(first_year), '{}-12-31'.format(last_year), freq='D')
+    n_events = min(per_year * (last_year - first_year + 1), len(days))
+    return pd.DatetimeIndex(np.sort(rng.choice(days.values, n_events, replace=False)))
+
+
+def _french_calendar(days, kind):
+    """ events in the 'Dim. 2', 'Janvier 2011' layout of the christian and jewish calendars """
+
+    return pd.DataFrame({
+        0: [FRENCH_DAYS[d] + ' ' + str(n) for d, n in zip(days.dayofweek, days.day)],
+        1: [FRENCH_MONTHS[m - 1] + ' ' + str(y) for m, y in zip(days.month, days.year)],
+        2: kind,
+        3: ['Fête {}'.format(i % 20) for i in range(len(days))],
+        4: 'Description',
+        5: '',
+    })
+
+
+def _muslim_calendar(days):
+    """ events in the '15/02/2011,15,/02/2011' layout of the muslim calendar """
+
+    return pd.DataFrame({
+        0: [str(d.day) + d.strftime('/%m/%Y') for d in days],
+        1: days.day,
+        2: [d.strftime('/%m/%Y') for d in days],
+        3: 'musulman',
+        4: ['Fête {}'.format(i % 10) for i in range(len(days))],
+        5: 'Description',
+        6: 'Date variable (1 à 2 jours) en fonction de l\'observation de la lune.',
+    })
+
+
+def _ramadan(first_year, last_year):
+    # 29 days starting 11 days earlier every year, like the lunar calendar (1st of august in 2011)
+    starts = [pd.Timestamp(year, 1, 1) + pd.Timedelta(days=(212 - 11 * (year - 2011)) % 365)
+              for year in range(first_year, last_year + 1)]
+    days = pd.DatetimeIndex([start + pd.Timedelta(days=i) for start in starts for i in range(29)])
+    return pd.DataFrame({'date': days.strftime('%d/%m/%Y'), 'ramadan': 1})
+
+
+def _dishes(rng, n_dishes=3000):
+    words = rng.choice(DISH_WORDS, size=(n_dishes, 3))
+    return np.array([' '.join(w).capitalize() for w in words], dtype=object)
+
+
+def generate(root, n_canteens=100, first_year=2011, n_years=9, seed=0):
+    """
+    write every input CSV of the ETL into root/data for n_canteens canteens (two schools each)
+    and n_years years of attendance starting in january of first_year, return the attendance rows
+    """
+
+    data = Path(root) / 'data'
+    data.mkdir(parents=True, exist_ok=True)
+    last_year = first_year + n_years - 1
+
+    canteens = np.array(['SITE {:05d}'.format(i) for i in range(n_canteens)], dtype=object)
+    schools = pd.DataFrame([(canteen + ' ' + school, canteen, letter) for canteen in canteens
+                            for school, letter in SCHOOL_TYPES], columns=['ecole', 'cantine_nom', 'letter'])
+
+    # calendars
+    school_years = _school_years(first_year - 1, last_year)
+    school_years.sort_values('date_debut', ascending=False).to_csv(data / 'annees_scolaires.csv', index=False, date_format='%Y-%m-%d')
+    holidays = _holidays(school_years)
+    holidays.to_csv(data / 'vacances.csv', index=False, date_format='%Y-%m-%d')
+    public_holidays = _public_holidays(first_year - 1, last_year + 1, _rng(seed, 'jours_feries'))
+    public_holidays.to_csv(data / 'jours_feries.csv', index=False, date_format='%Y-%m-%d')
+
+    # religious calendars and strikes
+    for name, kind in [('fetes_chretiennes', 'chretien'), ('fetes_juives', 'juif')]:
+        days = _random_days(first_year, last_year, EVENTS_PER_YEAR[kind], _rng(seed, name))
+        _french_calendar(days, kind).to_csv(data / (name + '.csv'), header=False, index=False, encoding='ISO-8859-1')
+    days = _random_days(first_year, last_year, EVENTS_PER_YEAR['musulman'], _rng(seed, 'fetes_musulmanes'))
+    _muslim_calendar(days).to_csv(data / 'fetes_musulmanes.csv', header=False, index=False, encoding='ISO-8859-1')
+    _ramadan(first_year, last_year).to_csv(data / 'ramad.csv', index=False)
+    strikes = _random_days(first_year, last_year, 20, _rng(seed, 'greves'))
+    pd.DataFrame({'date': strikes.strftime('%Y-%m-%d'), 'greve': 1}).to_csv(
+        data / 'greves_restauration_et_ou_ecoles.csv', index=False)
+
+    # canteens and schools
+    schools[['ecole', 'cantine_nom']].assign(cantine_type='M/E').to_csv(data / 'appariement_ecoles_cantines.csv', index=False)
+
+    rng = _rng(seed, 'effectifs')
+    headcounts = pd.DataFrame({
+        'Ecole': np.repeat(schools['ecole'].values, len(school_years)),
+        'Année scolaire': np.tile(school_years['annee_scolaire'].values, len(schools)),
+        'Effectif': rng.integers(50, 300, len(schools) * len(school_years)),
+        'Début année scolaire': np.tile(school_years['date_debut'].dt.strftime('%Y-10-01').values, len(schools)),
+    })
+    headcounts.to_csv(data / 'effectifs_ecolesnantes.csv', sep=';', index=False)
+
+    rng = _rng(seed, 'geo_features')
+    n_schools = len(schools)
+    districts = rng.integers(0, max(n_canteens // 5, 1), n_schools)
+    longitude, latitude = -1.55 + rng.normal(0, 0.03, n_schools), 47.22 + rng.normal(0, 0.02, n_schools)
+    pd.DataFrame({
+        'nom_etab': (schools['cantine_nom'] + ' ' + schools['letter']).values,
+        'Appellation officielle': 'Ecole ' + schools['ecole'].str.lower().values,
+        'type_es': schools['letter'].values,
+        'Adresse': '1 rue des écoles', 'cp': 44000, 'Commune': 'Nantes',
+        'prix_moyen_m2_appartement': rng.integers(2500, 4500, n_schools),
+        'prix_moyen_m2_maison': rng.integers(3000, 5500, n_schools),
+        'id_quartier': districts // 3, 'Quartier': ['Quartier {}'.format(d // 3) for d in districts],
+        'prix_quartier_m2_appart': rng.integers(2500, 4500, n_schools),
+        'id_quartier_details': districts, 'Quartier_detail': ['Quartier détaillé {}'.format(d) for d in districts],
+        'prix_Quartier_detail_m2_appart': rng.integers(2500, 4500, n_schools),
+        'id_pole': districts % 5, 'Nom du pôle': ['Pôle {}'.format(d % 5) for d in districts],
+        'Longitude_Latitude': ['[{},{}]'.format(lon, lat) for lon, lat in zip(longitude, latitude)],
+    }).to_csv(data / 'geo_features.csv', sep=';', index=False)
+
+    # school days: week days of the school years, outside holidays and public holidays
+    days = pd.date_range('{}-01-01'.format(first_year), '{}-12-31'.format(last_year), freq='D')
+    in_school_year = np.zeros(len(days), dtype=bool)
+    for start, end in zip(school_years['date_debut'], school_years['date_fin']):
+        in_school_year |= (days >= start) & (days <= end)
+    for start, end in zip(holidays['date_debut'], holidays['date_fin']):
+        in_school_year &= ~((days >= start) & (days <= end))
+    school_days = days[in_school_year & (days.dayofweek < 5) & ~days.isin(public_holidays['date'])]
+
+    # menus: 4 or 5 dishes per school day, drawn from a vocabulary that repeats across years
+    rng = _rng(seed, 'menus')
+    dishes = _dishes(rng)
+    n_dishes = rng.integers(4, 6, len(school_days))
+    pd.DataFrame({
+        'Date': np.repeat(school_days.strftime('%Y-%m-%d'), n_dishes),
+        'Plat': rng.choice(dishes, n_dishes.sum()),
+    }).to_csv(data / 'menus-cantines-nantes-2011-2019.csv', sep=';', index=False)
+
+    # attendance: one row per school day and canteen
+    rng = _rng(seed, 'frequentation')
+    n_rows = len(school_days) * n_canteens
+    prevision = rng.integers(50, 400, n_rows)
+    reel = np.maximum(prevision - rng.integers(-10, 40, n_rows), 0)
+    pd.DataFrame({
+        'date': np.repeat(school_days.strftime('%Y-%m-%d'), n_canteens),
+        'site_nom': np.tile(canteens, len(school_days)),
+        'site_nom_sal': np.tile(canteens, len(school_days)),
+        'site_id': np.tile(np.arange(n_canteens), len(school_days)),
+        'site_type': 'M/E',
+        'prevision': prevision, 'reel': reel, 'prevision_s': prevision, 'reel_s': reel,
+    }).to_csv(data / 'frequentation_cantines_v2.csv', index=False)
+
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic input data for the ETL.')
+    parser.add_argument('root', help='the CSVs are written into root/data, run the ETL from root/ETL')
+    parser.add_argument('--canteens', type=int, default=100)
+    parser.add_argument('--first-year', type=int, default=2011)
+    parser.add_argument('--years', type=int, default=9)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    n_rows = generate(args.root, args.canteens, args.first_year, args.years, args.seed)
+    print('{} attendance rows written in {}.'.format(n_rows, Path(args.root) / 'data'))
+
+
+if __name__ == "__main__":
+    main()
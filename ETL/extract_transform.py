@@ -1,128 +1,205 @@
 # ETL:
-# Extract: selecting the right data and obtaining it 
+# Extract: selecting the right data and obtaining it
 # Transform: data cleansing is applied to that data while it sits in a staging area
 # Loading: loading of the transformed data into the data store or a data warehouse
 import numpy as np
-import pandas as pd 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import re
 
 from scripts.utils_date_features import *
 from scripts.utils_religion_features import *
 from scripts.utils_nlp_features import *
+from scripts.utils_proximity import LOOKBACK_DAYS
 
-############################## Attendance dataframe building ################################
+ATTENDANCE_PATH = '../data/frequentation_cantines_v2.csv'
 
-def main():
-    # read data from main CSVs 
-    effectifEcoles =  pd.read_csv('../data/effectifs_ecolesnantes.csv', header=0, sep=';')
-    effectifEcoles.drop(['Début année scolaire'], axis=1, inplace=True)
+# the other input files read by the stages
+HEADCOUNTS_PATH = '../data/effectifs_ecolesnantes.csv'
+PAIRING_PATH = '../data/appariement_ecoles_cantines.csv'
+SCHOOL_YEARS_PATH = '../data/annees_scolaires.csv'
+HOLIDAYS_PATH = '../data/vacances.csv'
+PUBLIC_HOLIDAYS_PATH = '../data/jours_feries.csv'
+STRIKES_PATH = '../data/greves_restauration_et_ou_ecoles.csv'
+GEO_PATH = '../data/geo_features.csv'
+MENUS_PATH = '../data/menus-cantines-nantes-2011-2019.csv'
 
-    appariement = pd.read_csv('../data/appariement_ecoles_cantines.csv', header=0, sep=',')
-    appariement.rename(columns={"ecole": "Ecole"}, inplace=True)
+# coordinates are rounded to this many decimals, the rounding also undoes their float32 storage between stages
+COORDINATES_DECIMALS = 4
+
+# explicit types of the attendance columns we keep, the duplicates columns are never read
+ATTENDANCE_DTYPES = {'site_type': 'category', 'site_nom': 'category', 'prevision': 'Int16', 'reel': 'Int16'}
+
+# enriched dataset handed to the staging step, as a compressed columnar file keeping the types
+DATA_PATH = 'data/data.parquet'
+
+# calendar dimension: the daily calendar features from the first day of the history
+# up to a horizon ahead of its last day, so that they are known for the days to predict
+CALENDAR_PATH = 'data/calendar.parquet'
+HORIZON_DAYS = 730
+
+# columns and types of the enriched dataset, fixed so that every chunk is written with the same schema
+DATA_DTYPES = {
+    'date': 'datetime64[ns]', 'cantine_nom': 'category', 'site_type': 'category',
+    'prevision': 'Int16', 'reel': 'Int16', 'annee_scolaire': 'category', 'Effectif': 'Int32',
+    'vacances_dans': 'int32', 'depuis_vacances': 'int32', 'ferie_dans': 'int32', 'depuis_ferie': 'int32',
+    **proximity_columns('int32'), **event_columns('int8'), 'greve': 'int8',
+    'Quartier_detail': 'category', 'prix_Quartier_detail_m2_appart': 'float64',
+    'prix_moyen_m2_appartement': 'float64', 'prix_moyen_m2_maison': 'float64',
+    'Longitude': 'float64', 'Latitude': 'float64', 'Plat': 'string',
+}
+
+# columns and types of the calendar dimension
+CALENDAR_DTYPES = {col: dtype for col, dtype in DATA_DTYPES.items() if col == 'date' or col == 'annee_scolaire'
+                   or col.endswith('_dans') or col.startswith('depuis_')
+                   or col in [*CALENDARS, 'greve']}
+
+
+def read_attendance(since=None, chunksize=None, usecols=None):
+    """
+    read the attendance CSV with explicit types, in chunks of chunksize rows when given
+    in incremental mode, only the days after the watermark (and the look-back window) are kept
+    """
+
+    usecols = usecols or ['date'] + list(ATTENDANCE_DTYPES)
+    chunks = pd.read_csv(ATTENDANCE_PATH, header=0, sep=',', usecols=usecols,
+                         dtype={col: ATTENDANCE_DTYPES[col] for col in usecols if col in ATTENDANCE_DTYPES},
+                         parse_dates=['date'], chunksize=chunksize)
+    if chunksize is None:
+        chunks = [chunks]
+
+    for freqJ in chunks:
+        # incremental mode: only the days after the watermark are processed, plus the look-back
+        # window whose proximity features may change and the history these features need
+        if since is not None:
+            window_start = pd.to_datetime(since) - pd.Timedelta(days=2 * LOOKBACK_DAYS)
+            freqJ = freqJ[freqJ["date"] > window_start]
+
+        freqJ = freqJ.rename(columns={'site_nom':'cantine_nom'})
+        yield freqJ[[col for col in ['date', 'cantine_nom', 'site_type', 'prevision', 'reel'] if col in freqJ]]
+
+
+def _calendar(bounds):
+    """ daily calendar between the bounds """
+    return pd.date_range(bounds[0], bounds[1], freq="D").to_frame(index=False, name="date")
+
+
+############################## ETL stages ################################
+# each stage only depends on the outputs of the stages given as arguments,
+# so that independent ones can run concurrently (see scripts/utils_dag.py)
+
+def calendar_bounds(since=None, chunksize=None):
+    """
+    first and last day of the attendance data
+    every feature but the headcounts and the geography only depends on the date:
+    they are computed once on the daily calendar covered by the attendance data
+    """
+
+    bounds = [(freqJ['date'].min(), freqJ['date'].max())
+              for freqJ in read_attendance(since, chunksize, usecols=['date']) if len(freqJ)]
+
+    # without any day there is no calendar to compute the features on
+    if not bounds:
+        raise ValueError('The attendance extract {} has no rows{}.'.format(
+            ATTENDANCE_PATH, '' if since is None else ' in the window of the watermark {}'.format(since)))
 
-    freqJ = pd.read_csv('../data/frequentation_cantines_v2.csv', header=0, sep=',', low_memory=False)
-    freqJ["date"] = pd.to_datetime(freqJ["date"])
+    return min(bound[0] for bound in bounds), max(bound[1] for bound in bounds)
 
-    # drop useless duplicate columns
-    freqJ.drop(['site_nom_sal', 'site_id', 'prevision_s', 'reel_s'], axis=1, inplace=True)
-    freqJ.rename(columns={'site_nom':'cantine_nom'}, inplace=True)
-    freqJ.sort_values(by='date', inplace=True, ascending=True)
-    freqJ.reset_index(inplace=True, drop=True)
+
+def calendar_horizon(calendar_bounds, horizon_days=None):
+    """ the days covered by the calendar features: the history and horizon_days after it """
+
+    horizon_days = HORIZON_DAYS if horizon_days is None else horizon_days
+    return calendar_bounds[0], calendar_bounds[1] + pd.Timedelta(days=horizon_days)
+
+
+def headcounts():
+    """ aggregated headcounts by canteen and school year """
+
+    # read data from main CSVs
+    effectifEcoles =  pd.read_csv(HEADCOUNTS_PATH, header=0, sep=';')
+    effectifEcoles.drop(['Début année scolaire'], axis=1, inplace=True)
+
+    appariement = pd.read_csv(PAIRING_PATH, header=0, sep=',')
+    appariement.rename(columns={"ecole": "Ecole"}, inplace=True)
 
     # get aggregated headcounts by canteen
     effectifEcoles = pd.merge(effectifEcoles, appariement[['cantine_nom','Ecole']], on='Ecole')
     effectifEcoles.rename(columns={'Année scolaire':'annee_scolaire'}, inplace=True)
     effectifCantines = effectifEcoles.groupby(['annee_scolaire','cantine_nom'], as_index=False).sum()
 
-    # join main df with the school year
-    freqJ = get_school_year(freqJ, 'date', '../data/annees_scolaires.csv')
+    return effectifCantines[['annee_scolaire', 'cantine_nom', 'Effectif']]
+
+
+def school_year(calendar_horizon):
+    """ label each day with its school year """
+    return get_school_year(_calendar(calendar_horizon), 'date', SCHOOL_YEARS_PATH)
 
-    # join main df with canteen headcounts
-    freqJ = pd.merge(freqJ, effectifCantines[['annee_scolaire', 'cantine_nom', 'Effectif']], on=['annee_scolaire', 'cantine_nom'])
 
-    ##  adding variable of interest based on insights from canteen employees
-    # often parents often withdraw their children a few days before the holidays or do not return until a few days later 
-    freqJ = get_distance_holidays(freqJ, 'date', '../data/vacances.csv')
+def holidays(calendar_horizon):
+    """
+    adding variable of interest based on insights from canteen employees
+    often parents often withdraw their children a few days before the holidays or do not return until a few days later
+    """
+    return get_distance_holidays(_calendar(calendar_horizon), 'date', HOLIDAYS_PATH)
 
-    # same logic goes for public holidays 
-    freqJ = get_distance_public(freqJ, 'date', '../data/jours_feries.csv')
 
+def public_holidays(calendar_horizon):
+    """ same logic goes for public holidays """
+    return get_distance_public(_calendar(calendar_horizon), 'date', PUBLIC_HOLIDAYS_PATH)
 
-    ############################## Religious evetns dataframe building #################################
-    # As stated in the specification, we will not include strikes in the analysis - the model should help agents in predicting normal periods.
-    # Moreover, most of the time, we will not have information about strikes at the time of making the prediction (2 or 3 weeks in advance)
-    # That said, we keep it for analysis purposes
 
-    greves = pd.read_csv('../data/greves_restauration_et_ou_ecoles.csv', header=0, sep=',')
+############################## Religious evetns dataframe building #################################
+# As stated in the specification, we will not include strikes in the analysis - the model should help agents in predicting normal periods.
+# Moreover, most of the time, we will not have information about strikes at the time of making the prediction (2 or 3 weeks in advance)
+# That said, we keep it for analysis purposes
+
+def strikes():
+    greves = pd.read_csv(STRIKES_PATH, header=0, sep=',')
     greves["date"] = pd.to_datetime(greves["date"])
 
-    # read and standardize data from main CSVs 
-    chretiennes = pd.read_csv('../data/fetes_chretiennes.csv', header=None, sep=',', encoding="ISO-8859-1")
-
-    # reconstruct date variable with regex
-    chretiennes['Année'] = chretiennes[1].apply(get_year)
-    chretiennes['Mois'] = chretiennes[1].apply(get_month).map({"Janvier": "01", "Février": "02", "Mars": "03", "Avril": "04",
-                                                            "Mai": "05", "Juin": "06", "Juillet": "07", "Août": "08", "Septembre": "09",
-                                                            "Octobre": "10", "Novembre": "11", "Décembre": "12"})
-    chretiennes['Jour'] = chretiennes[0].apply(get_day)
-    chretiennes['Jour'] = chretiennes['Jour'].apply(lambda x: x.zfill(2))
-    chretiennes['date'] = chretiennes['Jour'].astype(str) + '/' + chretiennes['Mois'].astype(str) + '/' + chretiennes['Année'].astype(str)
-    chretiennes['date']
-    chretiennes.drop([0, 1, 2, 3, 4, 5, 'Année', 'Mois', 'Jour'], axis=1, inplace=True)
-    chretiennes['chretiennes'] = 1
-    chretiennes["date"] = pd.to_datetime(chretiennes["date"], format="%d/%m/%Y")
-
-    # same for jewish events
-    juives = pd.read_csv('../data/fetes_juives.csv', header=None, sep=',', encoding="ISO-8859-1")
-    juives['Année'] = juives[1].apply(get_year)
-    juives['Mois'] = juives[1].apply(get_month).map({"Janvier": "01", "Février": "02", "Mars": "03", "Avril": "04",
-                                                    "Mai": "05", "Juin": "06", "Juillet": "07", "Août": "08", "Septembre": "09",
-                                                    "Octobre": "10", "Novembre": "11", "Décembre": "12"})
-    juives['Jour'] = juives[0].apply(get_day)
-    juives['Jour'] = juives['Jour'].apply(lambda x: x.zfill(2))
-    juives['date'] = juives['Jour'].astype(str) + '/' + juives['Mois'].astype(str) + '/' + juives['Année'].astype(str)
-    juives.drop([0, 1, 2, 3, 4, 5, 'Année', 'Mois', 'Jour'], axis=1, inplace=True)
-    juives['juives'] = 1
-    juives["date"] = pd.to_datetime(juives["date"], format="%d/%m/%Y")
-
-    # same for muslim events
-    musulm = pd.read_csv('../data/fetes_musulmanes.csv', header=None, sep=',', encoding = "ISO-8859-1")
-    musulm.drop([1,2,3,4,5,6], axis=1, inplace=True)
-    musulm.rename(columns={0: "date"}, inplace=True)
-    musulm['musulmanes'] = 1
-    musulm["date"] = musulm["date"].str.replace(" ", "")
-    musulm["date"] = pd.to_datetime(musulm["date"], format="%d/%m/%Y")
-
-    # same for ramadan
-    ramad = pd.read_csv('../data/ramad.csv', header=0, sep=',')
-    # ramad.rename(columns={0: "date", 1: "ramadan"}, inplace=True)
-    ramad["date"] = pd.to_datetime(ramad["date"], format="%d/%m/%Y")
-
-    # merge relgion events dataframes based on the length of the time serie (freqJ)
-    religion_dfs = [chretiennes, juives, musulm, ramad, greves]
-    religion_df = merge_religious_events(freqJ, 'date', religion_dfs)
+    return greves
+
+
+def religious_calendar(name):
+    # read and standardize data from one of the registered religious calendars
+    return read_calendar(name)
+
+
+def religious_events(calendar_horizon, strikes, **calendars):
+    """
+    proximity and boolean features of the religious events and strikes for each day,
+    calendars holds the events of each registered calendar (see CALENDARS)
+    """
+
+    calendar = _calendar(calendar_horizon)
+
+    # merge relgion events dataframes based on the length of the time serie (calendar)
+    religion_dfs = [calendars[name] for name in CALENDARS] + [strikes]
+    religion_df = merge_religious_events(calendar, 'date', religion_dfs)
     religion_df.drop_duplicates(inplace=True)
-    religion_df.to_csv('data/events.csv', index=False)
 
-    # following the same logic than for holidays and adding proximity variables from religious events
-    freqJ = events_in_ago(freqJ, 'date', 'data/events.csv')
+    # following the same logic than for holidays and adding proximity variables from religious events,
+    # the events are handed over in memory so that a cached run never reads stale ones
+    calendar = events_in_ago(calendar, 'date', religion_df)
 
     # adding the religous bolean features
-    freqJ = pd.merge(freqJ, religion_df, how='left', on='date')
-    freqJ.sort_index(inplace=True, ascending=True)
-    freqJ.sort_values(by='date', inplace=True, ascending=True)
-    freqJ.reset_index(inplace=True, drop=True)
+    calendar = pd.merge(calendar, religion_df, how='left', on='date')
 
+    return calendar
 
-    ############################## Geographic dataframe building #################################
-    # now that we have created our main analysis table, we can go on to integrate additional data
 
+############################## Geographic dataframe building #################################
+# now that we have created our main analysis table, we can go on to integrate additional data
+
+def geography():
     # read data from main CSVs
-    appariement = pd.read_csv('../data/appariement_ecoles_cantines.csv', header=0, sep=',')
+    appariement = pd.read_csv(PAIRING_PATH, header=0, sep=',')
     appariement.rename(columns={"ecole": "Ecole"}, inplace=True)
     appariement['Ecole'] = appariement['Ecole'].apply(lambda x: x.rsplit(' ', 1)[0])
 
-    geo_features = pd.read_csv('../data/geo_features.csv', header=0, sep=';') 
+    geo_features = pd.read_csv(GEO_PATH, header=0, sep=';')
     geo_features['nom_etab'] = geo_features['nom_etab'].apply(lambda x: x.rsplit(' ', 1)[0])
     geo_features.rename(columns={"nom_etab": "Ecole"}, inplace=True)
 
@@ -130,38 +207,133 @@ def main():
     geo_features = pd.merge(geo_features, appariement[['cantine_nom', 'Ecole']].drop_duplicates(subset=['Ecole']), how='inner', on='Ecole')
 
     # subsetting to keep only the necessary date for analysis
-    geo_features = geo_features[['cantine_nom', 'Quartier_detail', 'prix_Quartier_detail_m2_appart', 
+    geo_features = geo_features[['cantine_nom', 'Quartier_detail', 'prix_Quartier_detail_m2_appart',
                                 'prix_moyen_m2_appartement', 'prix_moyen_m2_maison', 'Longitude_Latitude']]
 
     # extract latitude and longitude information using regex
     geo_features['Longitude_Latitude'] = geo_features['Longitude_Latitude'].apply(lambda x: re.findall('\d+\.\d+', x) )
-    geo_features['Longitude'] = geo_features['Longitude_Latitude'].apply(lambda x: x[0]).astype(float).round(4)
-    geo_features['Latitude'] = geo_features['Longitude_Latitude'].apply(lambda x: x[1]).astype(float).round(4)
+    geo_features['Longitude'] = geo_features['Longitude_Latitude'].apply(lambda x: x[0]).astype(float).round(COORDINATES_DECIMALS)
+    geo_features['Latitude'] = geo_features['Longitude_Latitude'].apply(lambda x: x[1]).astype(float).round(COORDINATES_DECIMALS)
     geo_features.drop('Longitude_Latitude', axis=1, inplace=True)
 
-    # adding the geographic features to main df
-    freqJ = pd.merge(freqJ, geo_features.drop_duplicates(subset=['cantine_nom']), how='left', on='cantine_nom')
-    freqJ["date"] = pd.to_datetime(freqJ["date"])
-    freqJ.sort_index(inplace=True, ascending=True)
+    return geo_features.drop_duplicates(subset=['cantine_nom'])
+
 
-    ############################## Menus dataframe building #################################
-    # extracting and cleaning the menus in the form of a string of characters
+############################## Menus dataframe building #################################
+# extracting and cleaning the menus in the form of a string of characters
 
+def menus(calendar_bounds, stem_menus=False):
     # read data from menu CSV
-    menus = pd.read_csv('../data/menus-cantines-nantes-2011-2019.csv', header=0, sep=';')
+    menus = pd.read_csv(MENUS_PATH, header=0, sep=';')
     menus.rename(columns={"Date": "date"}, inplace=True)
     menus["date"] = pd.to_datetime(menus["date"])
-    menus.sort_values(by='date', inplace=True, ascending=True)
+    menus = menus[(menus["date"] >= calendar_bounds[0]) & (menus["date"] <= calendar_bounds[1])]
+    # stable sort so that dishes keep their order within a day whatever the window
+    menus.sort_values(by='date', inplace=True, ascending=True, kind='mergesort')
     menus = menus.reset_index(drop=True)
 
-    # group by date and apply transformation for further NLP
-    menus = menus.groupby('date',as_index=False)['Plat'].apply(lambda text : ' '.join(parse_text(text)))
+    # normalize every distinct dish once and join the dishes of each date for further NLP
+    menus = normalize_menus(menus, stem=stem_menus)
+
+    return menus
+
+
+############################## Attendance dataframe building ################################
+
+def enrich_attendance(freqJ, calendar, headcounts, geography, menus):
+    """ join attendance rows with the daily calendar features and the canteens dimensions """
+
+    freqJ = freqJ.sort_values(by='date', ascending=True, kind='mergesort')
+
+    # join main df with the school year
+    freqJ = pd.merge(freqJ, calendar[['date', 'annee_scolaire']], on='date')
+
+    # join main df with canteen headcounts
+    freqJ = pd.merge(freqJ, headcounts, on=['annee_scolaire', 'cantine_nom'])
+
+    # adding the holidays, public holidays and religious features
+    freqJ = pd.merge(freqJ, calendar.drop(columns=['annee_scolaire']), on='date')
+
+    # adding the geographic features to main df
+    freqJ = pd.merge(freqJ, geography, how='left', on='cantine_nom')
 
     # adding the menu feature to main df
     data = pd.merge(freqJ, menus, how='left', on='date')
-    data["date"] = pd.to_datetime(data["date"])
-    data.sort_index(inplace=True, ascending=True)
-    data.to_csv('data/data.csv', index=False)
+
+    return data
+
+
+def _data_schema(schema):
+    """ parquet schema of the first chunk, with categories wide enough for any later chunk """
+
+    # an empty chunk gives categories without values, they are labels (strings) anyway
+    fields = [pa.field(field.name, pa.dictionary(pa.int32(), pa.string()))
+              if pa.types.is_dictionary(field.type) else field for field in schema]
+
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+def calendar(school_year, holidays, public_holidays, religious_events):
+    """ all the daily calendar features, one row per day of the history and of the horizon """
+
+    calendar = school_year.merge(holidays, on='date').merge(public_holidays, on='date')
+    return calendar.merge(religious_events, on='date')
+
+
+def calendar_dimension(calendar):
+    """ write the calendar features to data/calendar.parquet, return the number of days """
+
+    calendar = calendar[list(CALENDAR_DTYPES)].astype(CALENDAR_DTYPES)
+    calendar.to_parquet(CALENDAR_PATH, index=False, compression='snappy')
+
+    return len(calendar)
+
+
+def attendance(headcounts, calendar, geography, menus, since=None, chunksize=None):
+    """
+    build data/data.parquet by enriching the attendance rows, the attendance file
+    is streamed in chunks of chunksize rows when given so that memory stays flat
+
+    return the number of rows written
+    """
+
+    # each chunk is appended to the parquet file as a new row group
+    writer = None
+    n_rows = 0
+    for freqJ in read_attendance(since, chunksize):
+        data = enrich_attendance(freqJ, calendar, headcounts, geography, menus)
+        data = data[list(DATA_DTYPES)].astype(DATA_DTYPES)
+        data[['Longitude', 'Latitude']] = data[['Longitude', 'Latitude']].round(COORDINATES_DECIMALS)
+        if writer is not None and not len(data):
+            continue
+
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(DATA_PATH, _data_schema(table.schema), compression='snappy')
+        writer.write_table(table.cast(writer.schema))
+        n_rows += len(data)
+
+    # an extract without any chunk still gives a file with the schema, read downstream as no rows
+    if writer is None:
+        empty = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in DATA_DTYPES.items()})
+        table = pa.Table.from_pandas(empty, preserve_index=False)
+        writer = pq.ParquetWriter(DATA_PATH, _data_schema(table.schema), compression='snappy')
+        writer.write_table(table.cast(writer.schema))
+
+    writer.close()
+
+    return n_rows
+
+
+def main(since=None, chunksize=None, horizon_days=None):
+    """ run the extract and transform stages one after another """
+
+    bounds = calendar_bounds(since, chunksize)
+    horizon = calendar_horizon(bounds, horizon_days)
+    features = calendar(school_year(horizon), holidays(horizon), public_holidays(horizon),
+                        religious_events(horizon, strikes(), **{name: religious_calendar(name) for name in CALENDARS}))
+    calendar_dimension(features)
+    attendance(headcounts(), features, geography(), menus(bounds), since=since, chunksize=chunksize)
 
     print('Extract and transform steps done.')
 
@@ -1,69 +1,317 @@
+import os
 import sqlite3 as sql
 from sqlalchemy import *
+import numpy as np
 import pandas as pd
 
+from scripts.utils_dtypes import concat_lean
+from scripts.utils_proximity import LOOKBACK_DAYS
+from scripts.utils_religion_features import event_columns, proximity_columns
+
 
 ########################## Bulding the analytical database ############################
 # organizing the data from the staging db in order to answer the business needs
 
-def main():
-    # create a connector to the db
-    conn = sql.connect('data/staging_db.db')
-    data = pd.read_sql_query("SELECT * FROM frequentation", conn)
-    data["date"] = pd.to_datetime(data["date"])
+DTWH_PATH = 'data/frequentation_dtwh.db'
 
-    data.rename(columns={"Effectif": "effectif", "Quartier_detail": "quartier_detail", "prix_Quartier_detail_m2_appart":
-                "prix_quartier_detail_m2_appart", "Longitude": "longitude", "Latitude": "latitude", "Plat": "plats"}, inplace=True)
+# full rebuilds are written to that file, then moved over the datawarehouse
+REBUILD_PATH = DTWH_PATH + '.rebuild'
 
-    # creating the foreign key in fact table for dim_site
-    data['site_id'] = data['cantine_nom'] + '_' + data['annee_scolaire']
-    data['site_id'] = pd.Categorical(data['site_id']).codes + 1
+# rows read at once from the staging db
+CHUNK_ROWS = 100000
 
-    # creating the FK in fact table for all other dimensions
-    data["date"] = pd.to_datetime(data["date"])
-    data['jour_id'] = pd.Categorical(data['date']).codes + 1
 
-    # dispatching the data into sub dfs that will feed the datawarehouse
+def get_watermark(source='frequentation', db_path=DTWH_PATH):
+    """
+    return the last loaded date of a source,
+    None when the datawarehouse has never been built
+    """
 
-    # fact table
-    frequentation_quotidienne_df = data[[
-        'jour_id', 'site_id', 'date', 'prevision', 'reel']]
+    if not os.path.exists(db_path):
+        return None
 
-    # geographic dimension
-    dim_site_df = data[['site_type', 'cantine_nom', 'annee_scolaire',
-                        'effectif', 'quartier_detail', 'prix_quartier_detail_m2_appart',
-                        'prix_moyen_m2_appartement', 'prix_moyen_m2_maison', 'longitude', 'latitude']]
+    # a missing table or a corrupt file is treated as a datawarehouse never built
+    conn = sql.connect(db_path)
+    try:
+        watermark = conn.execute("SELECT last_date FROM Etl_watermark WHERE source = ?",
+                                 (source,)).fetchone()
+        watermark = watermark[0] if watermark else None
+    except sql.DatabaseError:
+        watermark = None
+    conn.close()
 
-    # menus dimension 
-    dim_menu_df = data[['date', 'plats']]
+    return pd.to_datetime(watermark) if watermark is not None else None
 
-    # temporal dimension
-    dim_temporelle_df = data[['date', 'vacances_dans', 'depuis_vacances',
-                                'ferie_dans', 'depuis_ferie', 'chretiennes_dans', 'depuis_chretiennes',
-                                'juives_dans', 'depuis_juives', 'ramadan_dans', 'depuis_ramadan',
-                                'musulmanes_dans', 'depuis_musulmanes']]
 
-    # events dimensions
-    dim_events_df = data[['date', 'chretiennes', 'juives',
-                            'ramadan', 'musulmanes', 'greve']]
+def write_watermark(conn, data, source='frequentation'):
+    """
+    record the last loaded date of a source, only the attendance has one:
+    the menus extract is bounded by the attendance days already
+    """
 
-    # datawarehousing allow us to drop duplicates in dimension tables to improve efficiency
-    dim_site_df.drop_duplicates(inplace=True)
-    dim_menu_df.drop_duplicates(inplace=True)
-    dim_temporelle_df.drop_duplicates(inplace=True)
-    dim_events_df.drop_duplicates(inplace=True)
+    last_date = data['date'].max()
+    if pd.isnull(last_date):
+        return
 
-    # building the sql tables that will constitute the DTWH
+    # the stored watermark only moves forward
+    conn.execute('''INSERT INTO Etl_watermark (source, last_date) VALUES (?, ?)
+        ON CONFLICT(source) DO UPDATE SET last_date = MAX(last_date, excluded.last_date);''',
+        (source, str(last_date)))
 
-    # create a connector to the db
-    conn = sql.connect('data/frequentation_dtwh.db')
+
+# bulk-load settings used while the datawarehouse is rebuilt from scratch into a new file: the
+# rollback journal is kept in memory and writes are not synced, a crashed rebuild only leaves
+# that file behind, the datawarehouse is replaced by it once complete
+BULK_PRAGMAS = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF',
+    'cache_size': -256000,  # in KiB, ~250MB of page cache
+    'temp_store': 'MEMORY',
+}
+
+
+# secondary indexes matching the access paths of the training reads: date ranges, and the sites
+# of some canteens over all or some dates, the dimensions are joined on their integer primary key
+# and need none, canteen names are turned into site ids, the training table is refreshed by site
+INDEXES = {
+    'fact_date_site': 'Frequentation_quotidienne(date, site_id)',
+    'fact_site_date': 'Frequentation_quotidienne(site_id, date)',
+    'site_cantine': 'Dim_site(cantine_nom)',
+    'training_site': 'Entrainement(site_id)',
+}
+
+# indexes of the previous builds superseded by the ones above
+DROPPED_INDEXES = ['date']
+
+# star join read to train the model, filtered by the checked queries
+TRAINING_QUERY = """SELECT Frequentation_quotidienne.jour_site_id, Frequentation_quotidienne.site_id,
+    Frequentation_quotidienne.date, Frequentation_quotidienne.prevision, Frequentation_quotidienne.reel,
+    Dim_site.cantine_nom, Dim_site.annee_scolaire, Dim_site.effectif, Dim_site.quartier_detail,
+    Dim_site.prix_quartier_detail_m2_appart, Dim_site.prix_moyen_m2_appartement, Dim_site.prix_moyen_m2_maison,
+    Dim_site.longitude, Dim_site.latitude, Dim_temporelle.depuis_vacances, Dim_temporelle.depuis_ferie,
+    Dim_temporelle.depuis_juives, Dim_temporelle.ramadan_dans, Dim_temporelle.depuis_ramadan, Dim_evenement.greve
+    FROM Frequentation_quotidienne
+    LEFT JOIN Dim_site ON Frequentation_quotidienne.site_id = Dim_site.site_id
+    LEFT JOIN Dim_temporelle ON Frequentation_quotidienne.jour_id = Dim_temporelle.jour_id
+    LEFT JOIN Dim_evenement ON Frequentation_quotidienne.jour_id = Dim_evenement.jour_id
+    {} ORDER BY Frequentation_quotidienne.jour_site_id"""
+
+# days with a known attendance, the zeros are mistakes rather than meaningful values
+KNOWN_ATTENDANCE = 'Frequentation_quotidienne.reel IS NOT 0 AND Frequentation_quotidienne.reel IS NOT NULL'
+
+# denormalized training set materialized in the datawarehouse: the days with a known attendance
+# with their features and outlier flags, as the model training computes them
+TRAINING_TABLE = 'Entrainement'
+
+# an attendance further than that many std from the mean of its canteen and school year is an outlier
+OUTLIER_STD = 2
+
+# training set read from the materialized table, a single scan in the fact table order
+TRAINING_TABLE_QUERY = """SELECT * FROM Entrainement
+    WHERE greve IS NOT 1 AND upper_outlier = 0 AND lower_outlier = 0
+    ORDER BY jour_site_id"""
+
+DATE_RANGE = 'Frequentation_quotidienne.date >= ? AND Frequentation_quotidienne.date < ?'
+SITES = 'Frequentation_quotidienne.site_id IN ({})'
+
+# checked queries with example params and the tables they may read whole, the whole history
+# is a scan of the fact table in its storage order and so is the training table
+PLAN_CHECKS = {
+    'history': (TRAINING_QUERY.format('WHERE ' + KNOWN_ATTENDANCE), [], {'Frequentation_quotidienne'}),
+    'training table': (TRAINING_TABLE_QUERY, [], {TRAINING_TABLE}),
+    'date range': (TRAINING_QUERY.format('WHERE ' + DATE_RANGE),
+                   ['2018-09-01 00:00:00', '2018-10-01 00:00:00'], set()),
+    'sites': (TRAINING_QUERY.format('WHERE ' + SITES.format('?')), [1], set()),
+    'date range of sites': (TRAINING_QUERY.format('WHERE {} AND {}'.format(DATE_RANGE, SITES.format('?'))),
+                            ['2018-09-01 00:00:00', '2018-10-01 00:00:00', 1], set()),
+    'canteen sites': ('SELECT site_id FROM Dim_site WHERE cantine_nom IN (?)', [''], set()),
+}
+
+
+def set_pragmas(conn, pragmas):
+    """ apply sqlite pragmas, they must be set outside of any transaction """
+
+    for name, value in pragmas.items():
+        conn.execute('PRAGMA {} = {};'.format(name, value))
+
+
+def sql_column(series):
+    """
+    convert a column into a list of python values sqlite can bind,
+    one vectorized conversion per column instead of one per cell
+    """
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        # dates are stored as pandas to_sql does, each distinct date is formatted once
+        codes, uniques = pd.factorize(series)
+        labels = np.append(uniques.strftime('%Y-%m-%d %H:%M:%S').to_numpy(dtype=object), None)
+        return labels[codes].tolist()
+
+    if series.dtype.kind in 'iub':
+        return series.tolist()
+
+    return series.astype(object).where(series.notnull(), None).tolist()
+
+
+def insert_rows(conn, table, df, replace=False):
+    """
+    insert the rows of df into table with a single executemany over the typed columns,
+    with replace, rows are matched on the primary key and the existing ones are replaced
+    """
+
+    columns = ', '.join('`{}`'.format(col) for col in df.columns)
+    placeholders = ', '.join('?' * len(df.columns))
+    verb = 'INSERT OR REPLACE' if replace else 'INSERT'
+    rows = zip(*[sql_column(df[col]) for col in df.columns])
+    conn.executemany('{} INTO `{}` ({}) VALUES ({});'.format(verb, table, columns, placeholders), rows)
+
+
+def upsert(conn, table, df):
+    """ insert or replace the rows of df into table, rows are matched on the primary key """
+
+    insert_rows(conn, table, df, replace=True)
+
+
+def create_indexes(conn):
+    """ create the secondary indexes, once the data is loaded it is a single sort """
+
+    for name in DROPPED_INDEXES:
+        conn.execute('DROP INDEX IF EXISTS `{}`;'.format(name))
+    for name, columns in INDEXES.items():
+        conn.execute('CREATE INDEX IF NOT EXISTS `{}` ON {};'.format(name, columns))
+
+
+def full_scans(conn, query, params=()):
+    """ tables and indexes read whole by the plan of a query """
+
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + query, params).fetchall()
+    # plan details read "SCAN <table> [USING ...]", "SCAN TABLE <table>" for older sqlite versions
+    return [detail.split()[2] if detail.startswith('SCAN TABLE ') else detail.split()[1]
+            for _, _, _, detail in plan if detail.startswith('SCAN ')]
+
+
+def check_query_plans(conn):
+    """ fail the build when a training query falls back to reading a table whole instead of its indexes """
+
+    failures = []
+    for name, (query, params, allowed) in PLAN_CHECKS.items():
+        scanned = [table for table in full_scans(conn, query, params) if table not in allowed]
+        if scanned:
+            failures.append('{}: full scan of {}'.format(name, ', '.join(scanned)))
+
+    if failures:
+        raise RuntimeError('training queries without a matching index, ' + '; '.join(failures))
+
+
+def create_training_table(conn):
+    """ create the training table, it can be added to a datawarehouse built without it """
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS `Entrainement` (
+        `jour_site_id` INTEGER PRIMARY KEY,
+        `site_id` INT NOT NULL,
+        `date` DATE NOT NULL,
+        `prevision` INT NULL,
+        `reel` INT NOT NULL,
+        `cantine_nom` VARCHAR(50) NULL,
+        `annee_scolaire` VARCHAR(30) NULL,
+        `effectif` INTEGER NULL,
+        `quartier_detail` VARCHAR(30) NULL,
+        `prix_quartier_detail_m2_appart` INTEGER NULL,
+        `prix_moyen_m2_appartement` INTEGER NULL,
+        `prix_moyen_m2_maison` INTEGER NULL,
+        `longitude` FLOAT NULL,
+        `latitude` FLOAT NULL,
+        `depuis_vacances` INTEGER NULL,
+        `depuis_ferie` INTEGER NULL,
+        `depuis_juives` INTEGER NULL,
+        `ramadan_dans` INTEGER NULL,
+        `depuis_ramadan` INTEGER NULL,
+        `greve` TINYINT(1) NULL,
+        `upper_outlier` TINYINT(1) NOT NULL,
+        `lower_outlier` TINYINT(1) NOT NULL);
+        ''')
+
+
+def flag_outliers(df, n=OUTLIER_STD):
+    """ flag the attendances further than n std from the mean of their canteen and school year """
+
+    grouped = df.groupby(['cantine_nom', 'annee_scolaire'])['reel']
+    mean, std = grouped.transform('mean'), grouped.transform('std')
+
+    return df.assign(upper_outlier=(df['reel'] > mean + n * std).astype(int),
+                     lower_outlier=(df['reel'] < mean - n * std).astype(int))
+
+
+def refresh_training_table(conn, since=None):
+    """
+    materialize the training set of the sites having facts after since, of every site when None:
+    a site is a canteen over a school year, the group its outlier bounds are computed on,
+    so the rows of a site are all computed again when new facts arrive
+    """
+
+    # a datawarehouse built without the training table gets it whole
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [TRAINING_TABLE]).fetchone() is None:
+        create_training_table(conn)
+        since = None
+
+    if since is None:
+        conn.execute('DELETE FROM Entrainement')
+        filters, params = 'WHERE ' + KNOWN_ATTENDANCE, []
+    else:
+        sites = 'SELECT DISTINCT site_id FROM Frequentation_quotidienne WHERE date > ?'
+        params = [since.strftime('%Y-%m-%d %H:%M:%S')]
+        conn.execute('DELETE FROM Entrainement WHERE site_id IN ({})'.format(sites), params)
+        filters = 'WHERE {} AND Frequentation_quotidienne.site_id IN ({})'.format(KNOWN_ATTENDANCE, sites)
+
+    training = flag_outliers(pd.read_sql_query(TRAINING_QUERY.format(filters), conn, params=params))
+    insert_rows(conn, TRAINING_TABLE, training)
+
+    return len(training)
+
+
+def assign_ids(conn, data):
+    """
+    reuse the site_id and jour_id already stored in the datawarehouse
+    and give the next free ids to new sites and new days
+    """
+
+    sites = pd.read_sql_query("SELECT site_id, cantine_nom, annee_scolaire FROM Dim_site", conn)
+    sites = sites.drop_duplicates(subset=['cantine_nom', 'annee_scolaire'])
+    new_sites = data[['cantine_nom', 'annee_scolaire']].drop_duplicates()
+    new_sites = new_sites.merge(sites, how='left', on=['cantine_nom', 'annee_scolaire'])
+    new_sites = new_sites.sort_values(['cantine_nom', 'annee_scolaire'])
+    missing = new_sites['site_id'].isnull()
+    new_sites.loc[missing, 'site_id'] = sites['site_id'].max() + np.arange(1, missing.sum() + 1)
+    data = data.merge(new_sites, how='left', on=['cantine_nom', 'annee_scolaire'])
+
+    days = pd.read_sql_query("SELECT jour_id, date FROM Dim_temporelle", conn, parse_dates=['date'])
+    new_days = data[['date']].drop_duplicates().sort_values('date')
+    new_days = new_days.merge(days, how='left', on='date')
+    missing = new_days['jour_id'].isnull()
+    new_days.loc[missing, 'jour_id'] = days['jour_id'].max() + np.arange(1, missing.sum() + 1)
+    data = data.merge(new_days, how='left', on='date')
+
+    data['site_id'] = data['site_id'].astype(int)
+    data['jour_id'] = data['jour_id'].astype(int)
+
+    return data
+
+
+def column_definitions(columns):
+    """ the definitions of nullable columns mapped to their sql type, as a create table statement lists them """
+
+    return ',\n        '.join('`{}` {} NULL'.format(col, sql_type) for col, sql_type in columns.items())
+
+
+def create_tables(conn):
+    """ drop and create the datawarehouse tables, indexes are created after the load """
 
     # drop table if exist
     cursor = conn.cursor()
-    for table in [ 'Frequentation_quotidienne', 'Dim_site', 'Dim_menu', 'Dim_temporelle', 'Dim_evenement']:
+    for table in [ 'Frequentation_quotidienne', 'Dim_site', 'Dim_menu', 'Dim_temporelle', 'Dim_evenement',
+                   'Dim_calendrier', 'Etl_watermark', 'Entrainement']:
         command = "DROP TABLE IF EXISTS {};".format(table)
         cursor.execute(command)
-    conn.commit()
 
 
     # Create Dim_temporelle
@@ -74,15 +322,8 @@ def main():
         `depuis_vacances` INTEGER NULL,
         `ferie_dans` INTEGER NULL,
         `depuis_ferie` INTEGER NULL,
-        `chretiennes_dans` INTEGER NULL,
-        `depuis_chretiennes` INTEGER NULL,
-        `musulmanes_dans` INTEGER NULL,
-        `depuis_musulmanes` INTEGER NULL,
-        `ramadan_dans` INTEGER NULL,
-        `depuis_ramadan` INTEGER NULL,
-        `juives_dans` INTEGER NULL,
-        `depuis_juives` INTEGER NULL);
-        ''')
+        {});
+        '''.format(column_definitions(proximity_columns('INTEGER'))))
 
     # Create Dim_site
     cursor.execute('''CREATE TABLE IF NOT EXISTS `Dim_site` (
@@ -110,12 +351,9 @@ def main():
     cursor.execute('''CREATE TABLE IF NOT EXISTS `Dim_evenement` (
         `jour_id` INTEGER PRIMARY KEY AUTOINCREMENT,
         `date` DATE NOT NULL,
-        `chretiennes` TINYINT(1) NULL,
-        `juives` TINYINT(1) NULL,
-        `ramadan` TINYINT(1) NULL,
-        `musulmanes` TINYINT(1) NULL,
+        {},
         `greve` TINYINT(1) NULL);
-        ''')
+        '''.format(column_definitions(event_columns('TINYINT(1)'))))
 
     # Create fact table (setting up the FKs and reference to dimensions)
     cursor.execute('''CREATE TABLE IF NOT EXISTS `Frequentation_quotidienne` (
@@ -147,23 +385,142 @@ def main():
             ON UPDATE NO ACTION);
             ''')
 
-    # create index on date for faster retrieval
-    cursor.execute(''' CREATE INDEX date 
-    ON Frequentation_quotidienne(date); ''')        
-    conn.commit()
-
-    # insertion des données dans le dtwh
-    frequentation_quotidienne_df.to_sql('Frequentation_quotidienne', 
-                        conn, if_exists='append', index=False)   
-    dim_site_df.to_sql('Dim_site', conn,
-                        if_exists='append', index=False)
-    dim_menu_df.to_sql('Dim_menu', conn,
-                        if_exists='append', index=False)
-    dim_temporelle_df.to_sql('Dim_temporelle', 
-                        conn, if_exists='append', index=False)
-    dim_events_df.to_sql('Dim_evenement', conn,
-                        if_exists='append', index=False)
-    conn.commit()
+    # Create Dim_calendrier, the calendar features of any day up to the horizon, looked up by date
+    cursor.execute('''CREATE TABLE IF NOT EXISTS `Dim_calendrier` (
+        `date` DATE PRIMARY KEY,
+        `annee_scolaire` VARCHAR(30) NULL,
+        `vacances_dans` INTEGER NULL,
+        `depuis_vacances` INTEGER NULL,
+        `ferie_dans` INTEGER NULL,
+        `depuis_ferie` INTEGER NULL,
+        {},
+        {},
+        `greve` TINYINT(1) NULL);
+        '''.format(column_definitions(proximity_columns('INTEGER')), column_definitions(event_columns('TINYINT(1)'))))
+
+    create_training_table(conn)
+
+    # Create the table keeping track of the last loaded date of each source
+    cursor.execute('''CREATE TABLE IF NOT EXISTS `Etl_watermark` (
+        `source` VARCHAR(30) PRIMARY KEY,
+        `last_date` DATE NOT NULL);
+        ''')
+
+    cursor.close()
+
+
+def main(incremental=False):
+    # create a connector to the db
+    conn = sql.connect('data/staging_db.db')
+    # read by chunks given memory-lean types before the frame is sliced into the tables,
+    # floats are stored as they are
+    chunks = pd.read_sql_query("SELECT * FROM frequentation", conn, chunksize=CHUNK_ROWS, parse_dates=['date'])
+    data = concat_lean(chunks, float32=False)
+    dim_calendrier_df = pd.read_sql_query("SELECT * FROM calendrier", conn, parse_dates=['date'])
+
+    data.rename(columns={"Effectif": "effectif", "Quartier_detail": "quartier_detail", "prix_Quartier_detail_m2_appart":
+                "prix_quartier_detail_m2_appart", "Longitude": "longitude", "Latitude": "latitude", "Plat": "plats"}, inplace=True)
+
+    # incremental mode needs a datawarehouse that has already been built once
+    watermark = get_watermark() if incremental else None
+    if incremental and watermark is None:
+        print('No watermark found, rebuilding the whole datawarehouse.')
+
+    # create a connector to the dtwh, a full rebuild is written to a new file next to it
+    db_path = DTWH_PATH if watermark is not None else REBUILD_PATH
+    if watermark is None and os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sql.connect(db_path)
+
+    if watermark is not None:
+        # reuse the ids already stored, new sites and days get the next ones
+        data = assign_ids(conn, data)
+    else:
+        # creating the foreign key in fact table for dim_site
+        data['site_id'] = data['cantine_nom'].astype(str) + '_' + data['annee_scolaire'].astype(str)
+        data['site_id'] = pd.Categorical(data['site_id']).codes + 1
+
+        # creating the FK in fact table for all other dimensions
+        data["date"] = pd.to_datetime(data["date"])
+        data['jour_id'] = pd.Categorical(data['date']).codes + 1
+
+    # dispatching the data into sub dfs that will feed the datawarehouse
+
+    # fact table, in incremental mode the look-back days are already loaded
+    frequentation_quotidienne_df = data[[
+        'jour_id', 'site_id', 'date', 'prevision', 'reel']]
+    if watermark is not None:
+        frequentation_quotidienne_df = frequentation_quotidienne_df[frequentation_quotidienne_df['date'] > watermark]
+
+    # geographic dimension
+    dim_site_df = data[['site_id', 'site_type', 'cantine_nom', 'annee_scolaire',
+                        'effectif', 'quartier_detail', 'prix_quartier_detail_m2_appart',
+                        'prix_moyen_m2_appartement', 'prix_moyen_m2_maison', 'longitude', 'latitude']]
+
+    # menus dimension 
+    dim_menu_df = data[['jour_id', 'date', 'plats']]
+
+    # temporal dimension
+    dim_temporelle_df = data[['jour_id', 'date', 'vacances_dans', 'depuis_vacances',
+                                'ferie_dans', 'depuis_ferie', *proximity_columns()]]
+
+    # events dimensions
+    dim_events_df = data[['jour_id', 'date', *event_columns(), 'greve']]
+
+    # datawarehousing allow us to drop duplicates in dimension tables to improve efficiency
+    # ids are stored explicitly so that they always match the fact table foreign keys
+    dim_site_df = dim_site_df.drop_duplicates(subset=['site_id'])
+    dim_menu_df = dim_menu_df.drop_duplicates(subset=['jour_id'])
+    dim_temporelle_df = dim_temporelle_df.drop_duplicates(subset=['jour_id'])
+    dim_events_df = dim_events_df.drop_duplicates(subset=['jour_id'])
+
+    # in incremental mode, the oldest days were only processed as history for the proximity
+    # features, only the look-back window days may have changed and are updated
+    if watermark is not None:
+        window_start = watermark - pd.Timedelta(days=LOOKBACK_DAYS)
+        dim_menu_df = dim_menu_df[dim_menu_df['date'] > window_start]
+        dim_temporelle_df = dim_temporelle_df[dim_temporelle_df['date'] > window_start]
+        dim_events_df = dim_events_df[dim_events_df['date'] > window_start]
+        dim_calendrier_df = dim_calendrier_df[dim_calendrier_df['date'] > window_start]
+
+    # the whole build is a single transaction, a full rebuild also uses the bulk-load pragmas
+    conn.isolation_level = None
+    if watermark is None:
+        set_pragmas(conn, BULK_PRAGMAS)
+    conn.execute('BEGIN')
+
+    try:
+        # building the sql tables that will constitute the DTWH
+        if watermark is None:
+            create_tables(conn)
+
+        # insertion des données dans le dtwh
+        # dimension rows of the look-back window are replaced since their proximity features may change
+        insert_rows(conn, 'Frequentation_quotidienne', frequentation_quotidienne_df)
+        upsert(conn, 'Dim_site', dim_site_df)
+        upsert(conn, 'Dim_menu', dim_menu_df)
+        upsert(conn, 'Dim_temporelle', dim_temporelle_df)
+        upsert(conn, 'Dim_evenement', dim_events_df)
+        upsert(conn, 'Dim_calendrier', dim_calendrier_df)
+
+        # the training set of the sites whose facts or features may have changed is materialized again
+        refresh_training_table(conn, since=window_start if watermark is not None else None)
+
+        # indexes are built once the data is in, rather than maintained row by row
+        create_indexes(conn)
+        write_watermark(conn, data)
+
+        # refresh the statistics used by the query planner, then check the plans it makes with them,
+        # a failed check leaves the datawarehouse as it was
+        conn.execute('ANALYZE')
+        check_query_plans(conn)
+        conn.execute('COMMIT')
+    except BaseException:
+        # closing the connection rolls the transaction back, a partial rebuild is dropped
+        conn.close()
+        if watermark is None:
+            os.remove(db_path)
+        raise
 
     # check first row of each tables of DTWH
     # for table in ['Frequentation_quotidienne', 'Dim_site', 'Dim_menu', 'Dim_temporelle', 'Dim_evenement']:
@@ -174,10 +531,16 @@ def main():
     #         print(row, '\n')
     # conn.commit()
 
-    cursor.close()
+    conn.close()
+
+    # the complete rebuild replaces the datawarehouse atomically
+    if watermark is None:
+        os.replace(db_path, DTWH_PATH)
 
     print('Datawarehouse built succesfully.')
 
+    return len(frequentation_quotidienne_df)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,12 +1,113 @@
-import extract_transform
+import argparse
+import os
+from datetime import datetime
+from functools import partial
+
+import pandas as pd
+
+import extract_transform as et
 import staging
 import load
+from scripts.utils_cache import CACHE_DIR
+from scripts.utils_dag import Stage, resolve, run
+from scripts.utils_religion_features import CALENDARS
+from scripts.utils_report import compare_reports, previous_report_path, read_report, write_report
+
+
+def stage_staging(attendance, calendar_dimension):
+    return staging.main()
+
+
+def stage_load(staging, incremental=False):
+    return load.main(incremental=incremental)
+
+
+# the ETL as a dependency graph: each stage consumes the outputs of its inputs stages
+STAGES = [
+    Stage('calendar_bounds', et.calendar_bounds, inputs=[], params=['since', 'chunksize'],
+          files=[et.ATTENDANCE_PATH], cache=True),
+    Stage('calendar_horizon', et.calendar_horizon, inputs=['calendar_bounds'], params=['horizon_days'], cache=True),
+    Stage('headcounts', et.headcounts, inputs=[], params=[],
+          files=[et.HEADCOUNTS_PATH, et.PAIRING_PATH], cache=True),
+    Stage('school_year', et.school_year, inputs=['calendar_horizon'], params=[],
+          files=[et.SCHOOL_YEARS_PATH], cache=True),
+    Stage('holidays', et.holidays, inputs=['calendar_horizon'], params=[],
+          files=[et.HOLIDAYS_PATH], cache=True),
+    Stage('public_holidays', et.public_holidays, inputs=['calendar_horizon'], params=[],
+          files=[et.PUBLIC_HOLIDAYS_PATH], cache=True),
+    # one stage per registered religious calendar, named after it
+    *[Stage(name, partial(et.religious_calendar, name), inputs=[], params=[],
+            files=[calendar.path], cache=True) for name, calendar in CALENDARS.items()],
+    Stage('strikes', et.strikes, inputs=[], params=[],
+          files=[et.STRIKES_PATH], cache=True),
+    Stage('religious_events', et.religious_events,
+          inputs=['calendar_horizon', 'strikes', *CALENDARS], params=[], cache=True),
+    Stage('calendar', et.calendar, inputs=['school_year', 'holidays', 'public_holidays', 'religious_events'],
+          params=[], cache=True),
+    Stage('geography', et.geography, inputs=[], params=[],
+          files=[et.PAIRING_PATH, et.GEO_PATH], cache=True),
+    Stage('menus', et.menus, inputs=['calendar_bounds'], params=['stem_menus'],
+          files=[et.MENUS_PATH], cache=True),
+    # the last stages write the parquet files and the databases, they always run
+    Stage('calendar_dimension', et.calendar_dimension, inputs=['calendar'], params=[]),
+    Stage('attendance', et.attendance, inputs=['headcounts', 'calendar', 'geography', 'menus'],
+          params=['since', 'chunksize']),
+    Stage('staging', stage_staging, inputs=['attendance', 'calendar_dimension'], params=[]),
+    Stage('load', stage_load, inputs=['staging'], params=['incremental']),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the ETL process.')
+    parser.add_argument('stage', nargs='?', default=None, choices=[stage.name for stage in STAGES],
+                        help='only run this stage and the stages it depends on')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only process the days after the last loaded date instead of rebuilding everything')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='stream the attendance CSV by chunks of this many rows to bound memory')
+    parser.add_argument('--stem-menus', action='store_true',
+                        help='reduce the menus words to their stem')
+    parser.add_argument('--horizon-days', type=int, default=et.HORIZON_DAYS,
+                        help='days after the last attendance day covered by the calendar dimension')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes running independent stages concurrently (default: all cores)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only print the stages that would run, dependencies first')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also report the peak memory allocated by each stage, slows the run down')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='run every stage instead of reusing the cached outputs of the unchanged ones')
+    parser.add_argument('--compare', metavar='REPORT', default=None,
+                        help='compare the run with this report (default: the report of the previous run)')
+    args = parser.parse_args()
+
+    targets = [args.stage] if args.stage else None
+    if args.dry_run:
+        print('\n'.join(resolve(STAGES, targets or [stage.name for stage in STAGES])))
+        return
+
+    # the outputs of the stages are written to data, missing on a fresh checkout
+    os.makedirs('data', exist_ok=True)
+
+    # in incremental mode, start from the last date loaded in the datawarehouse
+    since = load.get_watermark() if args.incremental else None
+
+    # execute the ETL, independent stages running concurrently
+    params = dict(since=since, chunksize=args.chunksize, incremental=since is not None, stem_menus=args.stem_menus,
+                  horizon_days=args.horizon_days)
+    started = datetime.now()
+    _, metrics = run(STAGES, targets, workers=args.workers, trace_memory=args.trace_memory,
+                     cache_dir=None if args.no_cache else CACHE_DIR, **params)
 
+    # per stage times, memory and rows, compared with the previous run
+    report = write_report(metrics, params, started)
+    previous = args.compare or previous_report_path()
+    if os.path.exists(previous):
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(compare_reports(report, read_report(previous)))
 
-# execute the whole ETL one step at a time
-extract_transform.main()
-staging.main()
-load.main()
+    print('ETL process completed.')
 
-print('ETL process completed.')
 
+if __name__ == "__main__":
+    main()
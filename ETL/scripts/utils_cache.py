@@ -0,0 +1,110 @@
+import glob
+import hashlib
+import inspect
+import os
+import pickle
+from functools import lru_cache
+
+import pandas as pd
+
+
+# outputs of the cached stages, keyed by the fingerprint of everything they depend on
+CACHE_DIR = 'data/cache'
+
+# the least recently used entries are evicted above that size
+CACHE_MAX_BYTES = 512 * 2**20
+
+# source files of the helpers shared by the stages
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py')
+
+
+@lru_cache(maxsize=None)
+def _file_hash(path, size, mtime):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_hash(path):
+    """ hash of the content of a file, only computed again when its size or modification time change """
+
+    stat = os.stat(path)
+    return _file_hash(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def code_hash(func):
+    """ version of the code of a stage: the module defining it and the shared helpers """
+
+    module = inspect.getmodule(getattr(func, 'func', func))
+    paths = [module.__file__] + sorted(glob.glob(SCRIPTS))
+    return hashlib.sha256(''.join(file_hash(path) for path in paths).encode()).hexdigest()
+
+
+def value_hash(value):
+    """ hash of the content of a stage output """
+
+    if isinstance(value, pd.DataFrame):
+        digest = hashlib.sha256(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        digest.update(repr(list(zip(value.columns, value.dtypes.astype(str)))).encode())
+        return digest.hexdigest()
+
+    return hashlib.sha256(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+
+def fingerprint(stage, inputs_hashes, params):
+    """
+    fingerprint of a stage run: its code, the files it reads, the content
+    of the outputs of its input stages and the values of its params
+    """
+
+    parts = [stage.name, code_hash(stage.func)]
+    parts += ['{}={}'.format(path, file_hash(path)) for path in stage.files]
+    parts += ['{}={}'.format(name, inputs_hashes[name]) for name in stage.inputs]
+    parts += ['{}={!r}'.format(name, params.get(name)) for name in stage.params]
+
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+def _entry_path(name, key, cache_dir):
+    return os.path.join(cache_dir, '{}-{}.pkl'.format(name, key[:32]))
+
+
+def load(name, key, cache_dir=CACHE_DIR):
+    """ return (True, output) when the stage output is cached, (False, None) otherwise """
+
+    path = _entry_path(name, key, cache_dir)
+    try:
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return False, None
+
+    # a hit makes the entry the most recently used one
+    os.utime(path)
+    return True, value
+
+
+def store(name, key, value, cache_dir=CACHE_DIR):
+    """ cache a stage output, written aside then renamed so that a reader never sees a partial entry """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _entry_path(name, key, cache_dir)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """ remove the least recently used entries until the cache fits in max_bytes """
+
+    entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+               for entry in os.scandir(cache_dir) if entry.name.endswith('.pkl')] if os.path.isdir(cache_dir) else []
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
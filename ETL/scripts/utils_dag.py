@@ -0,0 +1,110 @@
+import time
+from collections import namedtuple
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from scripts import utils_cache as cache
+from scripts.utils_dtypes import lean_dtypes
+from scripts.utils_report import count_rows, measure
+
+
+# a named step of the ETL: func is called with the outputs of the stages listed in
+# inputs (as keyword arguments named after them) and with the run params it declares
+# the output of a stage without side effects can be cached: files lists what it reads
+# so that it is only computed again when one of them, its code, inputs or params change
+Stage = namedtuple('Stage', ['name', 'func', 'inputs', 'params', 'files', 'cache'], defaults=((), False))
+
+
+def _run_stage(func, **kwargs):
+    """ run a stage, its output crosses the stage boundary with memory-lean types """
+    return lean_dtypes(func(**kwargs))
+
+
+def resolve(stages, targets):
+    """ return the targets and all the stages they depend on, dependencies first """
+
+    by_name = {stage.name: stage for stage in stages}
+    ordered = []
+    visiting = set()
+
+    def _visit(name):
+        if name in ordered:
+            return
+        if name not in by_name:
+            raise ValueError(f'unknown stage {name!r}')
+        if name in visiting:
+            raise ValueError(f'cycle in the stages dependencies around {name!r}')
+
+        visiting.add(name)
+        for dependency in by_name[name].inputs:
+            _visit(dependency)
+        visiting.remove(name)
+        ordered.append(name)
+
+    for target in targets:
+        _visit(target)
+
+    return ordered
+
+
+def run(stages, targets=None, workers=None, trace_memory=False, cache_dir=None, **params):
+    """
+    run the targets stages (all of them by default) and their dependencies on a process pool:
+    a stage is submitted as soon as its inputs are available, so independent ones run concurrently
+    and the wall time tends to the critical path
+
+    with a cache_dir, the cacheable stages whose fingerprint did not change are not run again,
+    their output is read from the cache (see scripts/utils_cache.py)
+
+    return the outputs and the metrics of each stage (see scripts/utils_report.py)
+    """
+
+    by_name = {stage.name: stage for stage in stages}
+    todo = resolve(stages, targets or list(by_name))
+    results = {}
+    metrics = {}
+    running = {}
+    # content hashes of the outputs and fingerprints of the stages, when caching
+    hashes = {}
+    keys = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while todo or running:
+            for name in [name for name in todo if all(i in results for i in by_name[name].inputs)]:
+                stage = by_name[name]
+                todo.remove(name)
+
+                if cache_dir is not None and stage.cache:
+                    start = time.perf_counter()
+                    keys[name] = cache.fingerprint(stage, hashes, params)
+                    hit, output = cache.load(name, keys[name], cache_dir)
+                    if hit:
+                        results[name], hashes[name] = output, cache.value_hash(output)
+                        metrics[name] = {'wall_time': round(time.perf_counter() - start, 4),
+                                         'rows_out': count_rows(output), 'cached': True}
+                        print(f'Stage {name} cached.')
+                        continue
+
+                kwargs = {i: results[i] for i in stage.inputs}
+                kwargs.update({p: params.get(p) for p in stage.params})
+                running[pool.submit(measure, partial(_run_stage, stage.func), trace_memory, **kwargs)] = name
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], metrics[name] = future.result()
+                metrics[name]['cached'] = False
+                print(f'Stage {name} done in {metrics[name]["wall_time"]:.2f}s.')
+
+                if cache_dir is not None:
+                    hashes[name] = cache.value_hash(results[name])
+                    if by_name[name].cache:
+                        cache.store(name, keys[name], results[name], cache_dir)
+
+    if cache_dir is not None:
+        cache.evict(cache_dir)
+
+    return results, metrics
@@ -1,6 +1,9 @@
 import pandas as pd
 import numpy as np
 
+from scripts.utils_intervals import in_intervals, interval_left_join
+from scripts.utils_proximity import proximity_features
+
 
 def get_school_year(data, date_col, data_path):
     """ add a new column annee_scolaire with annees_scolaires.csv file to the main dataframe """
@@ -20,27 +23,11 @@ def get_school_year(data, date_col, data_path):
     holidays = holidays[["annee_scolaire", "date_debut", "date_fin"]]
     holidays = holidays.drop_duplicates()
 
-    # simulate an interval based left join using pandas
-    # perform a cross join on temp_key
-    up_bound = "date_fin"
-    low_bound = "date_debut"
-    df['temp_key'] = 1
-    holidays['temp_key'] = 1
-    crossjoindf = pd.merge(df, holidays, on=['temp_key'])
-
-    df.drop(columns=['temp_key'], inplace=True)
-    crossjoindf.drop(columns=['temp_key'], inplace=True)
-    
-    # filter with lower_bound & upper_bound
-    conditionnal_df = crossjoindf[
-        (crossjoindf["date"] >= crossjoindf[low_bound]) & (crossjoindf["date"] <= crossjoindf[up_bound])]
-
-    # merge on the main df with all cols as keys to simulate left join
-    df_col = df.columns.values.tolist()
-    conditionnal_df.set_index(df_col, inplace=True)
-    df = df.merge(conditionnal_df, left_on=df_col, right_index=True, how='left')
+    # interval based left join: each day is located among the sorted
+    # school years with a binary search instead of a cross join
+    df = interval_left_join(df, 'date', holidays, 'date_debut', 'date_fin')
 
-    df.set_index('date', inplace=True) 
+    df.set_index('date', inplace=True)
     data = pd.merge(data, df['annee_scolaire'], on='date')
     
     return data
@@ -66,54 +53,14 @@ def get_distance_holidays(data, date_col, data_path):
     holidays = holidays[["vacances_nom", "date_debut", "date_fin", "zone", "vacances"]]
     holidays = holidays.drop_duplicates()
 
-    # simulate an interval based left join using pandas
-    # perform a cross join on temp_key
-    up_bound = "date_fin"
-    low_bound = "date_debut"
-    df['temp_key'] = 1
-    holidays['temp_key'] = 1
-    crossjoindf = pd.merge(df, holidays, on=['temp_key'])
+    # flag the days falling within holidays with a binary search over
+    # the sorted holidays bounds (overlapping zones are handled too)
+    is_holiday = in_intervals(df['date'], holidays['date_debut'], holidays['date_fin'])
+
+    # days until the next holidays and since the latest ones, 0 during holidays
+    flags = pd.DataFrame({'vacances': is_holiday}, index=df['date'])
+    df = proximity_features(flags)
 
-    df.drop(columns=['temp_key'], inplace=True)
-    crossjoindf.drop(columns=['temp_key'], inplace=True)
-    
-    # filter with lower_bound & upper_bound
-    conditionnal_df = crossjoindf[
-        (crossjoindf["date"] >= crossjoindf[low_bound]) & (crossjoindf["date"] <= crossjoindf[up_bound])]
-
-    # merge on the main df with all cols as keys to simulate left join
-    df_col = df.columns.values.tolist()
-    conditionnal_df.set_index(df_col, inplace=True)
-    df = df.merge(conditionnal_df, left_on=df_col, right_index=True, how='left')
- 
-    # find rows index corresponding to holidays
-    holidays_index = np.where(~df['vacances_nom'].isnull())[0]
-
-    # compute arrays of first day and last day of holidays
-    holidays_min_index = []
-    holidays_max_index = []
-    i = 0
-    while i < len(holidays_index):
-        j = 0
-        while i + j < len(holidays_index) and (holidays_index[i] + j) == holidays_index[i + j]:
-            j += 1
-        holidays_min_index.append(holidays_index[i])
-        holidays_max_index.append(holidays_index[i + j - 1])
-        i += j
-
-    indexes = range(0, len(df)) 
-    
-    # compute for each index row the distance with the nearest upcoming holidays
-    df['vacances_dans'] = [min([i - x for i in holidays_min_index if i > x], default=0) for x in indexes]
-    
-    # compute for each index row the distance with the latest past holidays
-    df['depuis_vacances'] = [min([x - i for i in holidays_max_index if i < x], default=0) for x in indexes]
-    
-    # set holidays_in and holidays_ago to 0 during effective holidays
-    df.loc[~df['vacances_nom'].isnull(), 'vacances_dans'] = 0
-    df.loc[~df['vacances_nom'].isnull(), 'depuis_vacances'] = 0
-    
-    df.set_index('date', inplace=True)
     data = pd.merge(data, df[['vacances_dans', 'depuis_vacances']], on='date')
     
     return data
@@ -127,7 +74,7 @@ def get_distance_public(data, date_col, data_path):
     # generate all dates within start and end 
     start = data[date_col].min()
     end = data[date_col].max()
-    df = pd.date_range(start, end, freq="D").to_frame(index=False, name="_date")
+    df = pd.date_range(start, end, freq="D").to_frame(index=False, name="date")
 
     # read external holidays csv
     def _parser(date):
@@ -137,56 +84,13 @@ def get_distance_public(data, date_col, data_path):
     pub_holidays = pub_holidays[["date", "nom_jour_ferie"]]
     pub_holidays = pub_holidays.drop_duplicates()
 
-    # simulate an interval based left join using pandas
-    # perform a cross join on temp_key
-    low_bound = "date"
-    df['temp_key'] = 1
-    pub_holidays['temp_key'] = 1
-    
-    crossjoindf = pd.merge(df, pub_holidays, on=['temp_key'])
-    df.drop(columns=['temp_key'], inplace=True)
-    crossjoindf.drop(columns=['temp_key'], inplace=True)
-     
-    # filter with lower_bound  
-    conditionnal_df = crossjoindf[(crossjoindf['_date'] == crossjoindf[low_bound])]
-
-    # merge on the main df with all cols as keys to simulate left join
-    df_col = df.columns.values.tolist()
-    conditionnal_df.set_index(df_col, inplace=True)
-    df = df.merge(conditionnal_df, left_on=df_col, right_index=True, how='left')
- 
-    # find rows index corresponding to holidays
-    pub_holidays_index = np.where(~df['nom_jour_ferie'].isnull())[0]
-
-    # compute arrays of first day and last day of holidays
-    pub_holidays_min_index = []
-    pub_holidays_max_index = []
-    i = 0
-    while i < len(pub_holidays_index):
-        j = 0
-        while i + j < len(pub_holidays_index) and (pub_holidays_index[i] + j) == pub_holidays_index[i + j]:
-            j += 1
-        pub_holidays_min_index.append(pub_holidays_index[i])
-        pub_holidays_max_index.append(pub_holidays_index[i + j - 1])
-        i += j
-
-    indexes = range(0, len(df)) 
-    
-    # compute for each index row the distance with the nearest upcoming public holiday
-    df['ferie_dans'] = [min([i - x for i in pub_holidays_min_index if i > x], default=0) for x in indexes]
-    
-    # compute for each index row the distance with the latest past holidays
-    df['depuis_ferie'] = [min([x - i for i in pub_holidays_max_index if i < x], default=0) for x in indexes]
-    
-    # set pub_holidays_in and pub_holidays_ago to 0 during effective holidays
-    df.loc[~df['nom_jour_ferie'].isnull(), 'ferie_dans'] = 0
-    df.loc[~df['nom_jour_ferie'].isnull(), 'depuis_ferie'] = 0
-    
-    # we drop date col that was just useful to define lower_bound 
-    # and we rename _date to have the same key name to join both dataframes
-    df.drop(columns=['date'], inplace=True)
-    df.rename(columns={"_date": "date"}, inplace=True)
-    df.set_index('date', inplace=True)
+    # a public holiday is a single day interval, flag them with a binary search
+    is_pub_holiday = in_intervals(df['date'], pub_holidays['date'], pub_holidays['date'])
+
+    # days until the next public holiday and since the latest one, 0 on public holidays
+    flags = pd.DataFrame({'ferie': is_pub_holiday}, index=df['date'])
+    df = proximity_features(flags)
+
     data = pd.merge(data, df[['ferie_dans', 'depuis_ferie']], on='date')
     
     return data
\ No newline at end of file
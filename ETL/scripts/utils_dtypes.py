@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+# a text column becomes a category when it has fewer distinct values than this share of its rows
+CATEGORY_MAX_RATIO = 0.5
+
+
+def lean_dtypes(df, float32=True):
+    """
+    memory-lean types applied to the stage outputs:
+    low cardinality text as categories, integer counters and flags downcast to the smallest
+    integer type holding their values, other floats (prices, coordinates) as float32
+    unless they must be kept exactly
+    """
+
+    if not isinstance(df, pd.DataFrame):
+        return df
+
+    lean = {}
+    for col in df.columns:
+        values = df[col]
+
+        if values.dtype == object or isinstance(values.dtype, pd.StringDtype):
+            if values.nunique() < CATEGORY_MAX_RATIO * len(values):
+                lean[col] = values.astype('category')
+
+        elif not isinstance(values.dtype, np.dtype):
+            # categories, nullable integers and dates are already typed
+            continue
+
+        elif values.dtype.kind in 'iu':
+            lean[col] = pd.to_numeric(values, downcast='integer')
+
+        elif values.dtype.kind == 'f':
+            if values.notnull().all() and np.array_equal(values, np.round(values)):
+                # counters and flags that went through a float because of a merge or a fillna
+                lean[col] = pd.to_numeric(values, downcast='integer')
+            elif float32 and values.dtype != np.float32:
+                lean[col] = values.astype(np.float32)
+
+    return df.assign(**lean) if lean else df
+
+
+def concat_lean(chunks, float32=True):
+    """
+    concatenate dataframe chunks once each of them has memory-lean types,
+    so that the whole frame never exists with its original types
+    """
+
+    chunks = [lean_dtypes(chunk, float32) for chunk in chunks]
+
+    # categories of different chunks are unified, otherwise the concatenation falls back to objects
+    for col in chunks[0].columns:
+        if any(isinstance(chunk[col].dtype, pd.CategoricalDtype) for chunk in chunks):
+            categories = union_categoricals([chunk[col].astype('category') for chunk in chunks]).categories
+            dtype = pd.CategoricalDtype(categories)
+            chunks = [chunk.assign(**{col: chunk[col].astype(dtype)}) for chunk in chunks]
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+def memory_mb(value):
+    """ memory held by a dataframe, strings included """
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return np.sum(value.memory_usage(deep=True)) / 2**20
+
+    return None
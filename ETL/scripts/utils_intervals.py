@@ -0,0 +1,72 @@
+import pandas as pd
+import numpy as np
+
+
+def _as_datetime64(values):
+    """ convert any date-like sequence into a datetime64[ns] numpy array """
+    return pd.DatetimeIndex(pd.to_datetime(values)).values.astype('datetime64[ns]')
+
+
+def _sorted_bounds(starts, ends):
+    """ sort intervals by lower bound once, so that every lookup is a binary search """
+    starts = _as_datetime64(starts)
+    ends = _as_datetime64(ends)
+    order = np.argsort(starts, kind='mergesort')
+
+    return starts[order], ends[order], order
+
+
+def in_intervals(dates, starts, ends):
+    """
+    return a boolean mask telling for each date whether it falls within
+    at least one [start, end] interval (bounds included, intervals may overlap)
+    """
+
+    dates = _as_datetime64(dates)
+    starts, ends, _ = _sorted_bounds(starts, ends)
+    if len(starts) == 0:
+        return np.zeros(len(dates), dtype=bool)
+
+    # furthest upper bound reached by any interval starting before a given one:
+    # a date is covered iff it is not after the reach of the last interval starting before it
+    reach = np.maximum.accumulate(ends)
+    pos = np.searchsorted(starts, dates, side='right') - 1
+
+    return (pos >= 0) & (dates <= reach[np.maximum(pos, 0)])
+
+
+def interval_positions(dates, starts, ends):
+    """
+    return for each date the position (in the original order) of the [start, end]
+    interval containing it, -1 when no interval does
+    intervals must not overlap, otherwise a date could match several rows
+    """
+
+    dates = _as_datetime64(dates)
+    starts, ends, order = _sorted_bounds(starts, ends)
+    if len(starts) == 0:
+        return np.full(len(dates), -1, dtype=np.int64)
+
+    if (starts[1:] <= ends[:-1]).any():
+        raise ValueError('intervals overlap, a date could match several of them')
+
+    pos = np.searchsorted(starts, dates, side='right') - 1
+    found = (pos >= 0) & (dates <= ends[np.maximum(pos, 0)])
+
+    return np.where(found, order[np.maximum(pos, 0)], -1)
+
+
+def interval_left_join(data, date_col, intervals, low_bound, up_bound):
+    """
+    left join the intervals columns onto the rows of data whose date falls within
+    [low_bound, up_bound], without materializing the days x intervals cross product
+    """
+
+    intervals = intervals.reset_index(drop=True)
+    pos = interval_positions(data[date_col], intervals[low_bound], intervals[up_bound])
+
+    # rows without interval get a NaN filled line, exactly like a sql left join
+    matched = intervals.reindex(pos)
+    matched.index = data.index
+
+    return pd.concat([data, matched], axis=1)
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 import nltk
 import re
+from functools import lru_cache
 from spacy.lang.fr.stop_words import STOP_WORDS as fr_stop
 from nltk.stem.snowball import FrenchStemmer
 
@@ -9,23 +10,53 @@ from nltk.stem.snowball import FrenchStemmer
 # using stemming of words
 stemmer = FrenchStemmer()
 
-# spliting a string using a regular expression 
-tokenizer = nltk.RegexpTokenizer(r'\w+')
+# patterns compiled once: digits, some characters and words
+digits = re.compile(r'\d+')
+characters = re.compile(r'[\(\[\)\]\{\}\.\/]+')
+words = re.compile(r'\w+')
 
-# lists of stop words to ignore
-stop_fr  = nltk.corpus.stopwords.words('french')
-stop_spacy_fr = list(fr_stop)
+# spliting a string using a regular expression
+tokenizer = nltk.RegexpTokenizer(words.pattern)
 
-def parse_text(text):
+# set of stop words to ignore, constant time lookups
+stop_words = frozenset(nltk.corpus.stopwords.words('french')) | frozenset(fr_stop)
+
+
+@lru_cache(maxsize=None)
+def normalize_dish(dish, stem=False):
+    """
+    Normalize a single dish: remove digits and some characters, lower case,
+    tokenize, remove stop words and optionally stem the words.
+    Menus repeat heavily across years so each distinct dish is only normalized once.
+    """
+    dish = characters.sub('', digits.sub('', dish)).lower()
+    text = [word for word in tokenizer.tokenize(dish) if word not in stop_words]
+    if stem:
+        text = [stemmer.stem(word) for word in text]
+
+    return tuple(text)
+
+
+def parse_text(text, stem=False):
     """
     Parse text to make it ready for further NLP analysis:
     lower case, remove digits, some characters, stop words...
-    """ 
-    text = [re.sub("\d+", "", word) for word in text]
-    text = [re.sub(r'[\(\[\)\]\{\}\.\/]+', '', word) for word in text]
-    text = [word.lower() for word in text]
-    text = tokenizer.tokenize(str(text))
-    text = [word for word in text if not word in stop_fr] 
-    text = [word for word in text if not word in stop_spacy_fr]
-    
-    return text
+    """
+    return [word for dish in text for word in normalize_dish(dish, stem)]
+
+
+def normalize_menus(menus, stem=False):
+    """
+    Normalize all the dishes of a menus dataframe (date, Plat) in one batched pass
+    and join the words of the dishes of each date, in their order
+    """
+    codes, dishes = pd.factorize(menus['Plat'])
+    normalized = np.array([' '.join(normalize_dish(dish, stem)) for dish in dishes] + [''], dtype=object)
+
+    # dishes left without any word are dropped so that they do not add blanks
+    text = pd.Series(normalized[codes], index=menus.index)
+    text = text[text != '']
+    joined = text.groupby(menus['date']).agg(' '.join)
+
+    dates = pd.Series(menus['date'].unique(), name='date')
+    return pd.DataFrame({'date': dates, 'Plat': joined.reindex(dates).fillna('').to_numpy()})
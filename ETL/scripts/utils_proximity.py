@@ -0,0 +1,64 @@
+import pandas as pd
+import numpy as np
+
+
+# longest gap between two events of the yearly calendars: a day whose features
+# are recomputed must see at least that many days of history to be exact
+LOOKBACK_DAYS = 400
+
+
+def event_proximity(flags):
+    """
+    compute, for every day of a contiguous daily calendar and every event column,
+    the number of days until the next event and since the latest one
+
+    flags is a (days, events) boolean array, both outputs have the same shape and
+    are 0 during the events themselves or when there is no event to look at
+    """
+
+    flags = np.asarray(flags, dtype=bool)
+    squeeze = flags.ndim == 1
+    if squeeze:
+        flags = flags[:, None]
+
+    n_days = flags.shape[0]
+    pos = np.arange(n_days)[:, None]
+
+    # run-length detection: a run starts where a flag rises and ends where it falls
+    padded = np.zeros((n_days + 2, flags.shape[1]), dtype=np.int8)
+    padded[1:-1] = flags
+    edges = np.diff(padded, axis=0)
+    is_start = edges[:-1] == 1
+    is_end = edges[1:] == -1
+
+    # carry the last run end forward and the next run start backward, all columns at once
+    last_end = np.maximum.accumulate(np.where(is_end, pos, -1), axis=0)
+    next_start = np.minimum.accumulate(np.where(is_start, pos, n_days)[::-1], axis=0)[::-1]
+
+    days_until = np.where(next_start < n_days, next_start - pos, 0)
+    days_since = np.where(last_end >= 0, pos - last_end, 0)
+
+    # during the events themselves we are neither before nor after them
+    days_until[flags] = 0
+    days_since[flags] = 0
+
+    if squeeze:
+        return days_until[:, 0], days_since[:, 0]
+
+    return days_until, days_since
+
+
+def proximity_features(flags):
+    """
+    turn a dataframe of boolean event columns indexed by a contiguous daily calendar
+    into <event>_dans and depuis_<event> features, computed in a single pass
+    """
+
+    days_until, days_since = event_proximity(flags.to_numpy())
+
+    features = {}
+    for i, col in enumerate(flags.columns):
+        features[col + '_dans'] = days_until[:, i]
+        features['depuis_' + col] = days_since[:, i]
+
+    return pd.DataFrame(features, index=flags.index)
@@ -1,22 +1,67 @@
 import pandas as pd
 import numpy as np
-import re
+from collections import namedtuple
 
+from scripts.utils_intervals import in_intervals
+from scripts.utils_proximity import proximity_features
 
-def get_year(date):
-    x = re.findall('([\d]{4})', date)
-    if x :
-        return x[0]
 
+# the french month names used by the calendar files, mapped once for all calendars
+FRENCH_MONTHS = {"Janvier": 1, "Février": 2, "Mars": 3, "Avril": 4, "Mai": 5, "Juin": 6, "Juillet": 7,
+                 "Août": 8, "Septembre": 9, "Octobre": 10, "Novembre": 11, "Décembre": 12}
 
-def get_month(date):
-    x = re.findall('^[A-Z][a-zéû]+', date)
-    if x:
-        return x[0]
+# date layouts of the calendar files, the date columns are joined with a space before the extraction
+# 'Dim. 2' + 'Janvier 2011'
+FRENCH_DATE = r'(?P<day>\d{1,2})\s+(?P<month>[A-Z][a-zéû]+)\s+(?P<year>\d{4})'
+# '15/02/2011', possibly with blanks around the separators
+NUMERIC_DATE = r'(?P<day>\d{1,2})\s*/\s*(?P<month>\d{1,2})\s*/\s*(?P<year>\d{4})'
 
+# a calendar file: where it is, which columns hold the date and in which layout
+Calendar = namedtuple('Calendar', ['path', 'date_columns', 'pattern', 'header'])
 
-def get_day(date):
-    return date[-2:]
+# the religious calendars, each one gives a boolean event column named after its key
+# and the matching proximity features: registering a new calendar only takes a line here
+CALENDARS = {
+    'chretiennes': Calendar('../data/fetes_chretiennes.csv', [0, 1], FRENCH_DATE, None),
+    'juives': Calendar('../data/fetes_juives.csv', [0, 1], FRENCH_DATE, None),
+    'musulmanes': Calendar('../data/fetes_musulmanes.csv', [0], NUMERIC_DATE, None),
+    'ramadan': Calendar('../data/ramad.csv', ['date'], NUMERIC_DATE, 0),
+}
+
+
+def proximity_columns(dtype=None):
+    """ the <name>_dans and depuis_<name> features of the registered calendars, mapped to dtype when one is given """
+
+    return {col: dtype for name in CALENDARS for col in [name + '_dans', 'depuis_' + name]}
+
+
+def event_columns(dtype=None):
+    """ the event flag of each registered calendar, mapped to dtype when one is given """
+
+    return {name: dtype for name in CALENDARS}
+
+
+def read_calendar(name, calendar=None):
+    """
+    read a calendar file into a (date, name) dataframe flagging its events,
+    the date parts are extracted with a single vectorized regex
+    """
+
+    calendar = calendar or CALENDARS[name]
+    events = pd.read_csv(calendar.path, header=calendar.header, sep=',', usecols=calendar.date_columns,
+                         dtype=str, encoding="ISO-8859-1")
+
+    text = events[calendar.date_columns[0]]
+    for col in calendar.date_columns[1:]:
+        text = text + ' ' + events[col]
+    parts = text.str.extract(calendar.pattern)
+
+    # month names are mapped to their number, numeric months are kept as they are
+    months = parts['month'].map(FRENCH_MONTHS).fillna(pd.to_numeric(parts['month'], errors='coerce'))
+    dates = pd.to_datetime(pd.DataFrame({'year': parts['year'].astype(int), 'month': months.astype(int),
+                                         'day': parts['day'].astype(int)}))
+
+    return pd.DataFrame({'date': dates, name: 1})
 
 
 def merge_religious_events(data, date_col, religion_dfs):
@@ -37,79 +82,28 @@ def merge_religious_events(data, date_col, religion_dfs):
     return religion_df
 
 
-def events_in_ago(data, date_col, data_path):
+def events_in_ago(data, date_col, events):
     """"
-    add features about how close and far we are from religious events
+    add features about how close and far we are from religious events,
+    events holds a flag column per registered calendar for each date
     """
 
     # generate all dates within start and end 
     start = data[date_col].min()
     end = data[date_col].max()
-    dfs = pd.date_range(start, end, freq="D").to_frame(index=False, name="_date")
-
-    # read external holidays csv
-    def _parser(date):
-        return pd.to_datetime(date)
-
-    events = pd.read_csv(f'{data_path}', parse_dates=['date'], date_parser=_parser)
-
-    for col in ['chretiennes', 'juives', 'ramadan', 'musulmanes']:
-        df = dfs.copy()
-        event = events.copy()
-        event = event[["date", col]]
-        event = event[event[col] != 0]
-        event = event.drop_duplicates()
-
-        # simulate an interval based left join using pandas
-        # perform a cross join on temp_key
-        low_bound = "date"
-        df['temp_key'] = 1
-        event['temp_key'] = 1
-
-        crossjoindf = pd.merge(df, event, on=['temp_key'])
-        df.drop(columns=['temp_key'], inplace=True)
-        crossjoindf.drop(columns=['temp_key'], inplace=True)
-
-        # filter with lower_bound  
-        conditionnal_df = crossjoindf[(crossjoindf['_date'] == crossjoindf[low_bound])]
-
-        # merge on the main df with all cols as keys to simulate left join
-        df_col = df.columns.values.tolist()
-        conditionnal_df.set_index(df_col, inplace=True)
-        df = df.merge(conditionnal_df, left_on=df_col, right_index=True, how='left')
-
-        # find rows index corresponding to holidays
-        events_index = np.where(~df[col].isnull())[0]
-
-        # compute arrays of first day and last day of holidays
-        events_min_index = []
-        events_max_index = []
-        i = 0
-        while i < len(events_index):
-            j = 0
-            while i + j < len(events_index) and (events_index[i] + j) == events_index[i + j]:
-                j += 1
-            events_min_index.append(events_index[i])
-            events_max_index.append(events_index[i + j - 1])
-            i += j
-
-        indexes = range(0, len(df)) 
-
-        # compute for each index row the distance with the nearest upcoming public holiday
-        df[col + '_dans'] = [min([i - x for i in events_min_index if i > x], default=0) for x in indexes]
-
-        # compute for each index row the distance with the latest past holidays
-        df[ 'depuis_' + col] = [min([x - i for i in events_max_index if i < x], default=0) for x in indexes]
-
-        # set pub_holidays_in and pub_holidays_ago to 0 during effective holidays
-        df.loc[~df[col].isnull(), col + '_dans'] = 0
-        df.loc[~df[col].isnull(), 'depuis_' + col] = 0
-
-        # we drop date col that was just useful to define lower_bound 
-        # and we rename _date to have the same key name to join both dataframes
-        df.drop(columns=['date'], inplace=True)
-        df.rename(columns={"_date": "date"}, inplace=True)
-        df.set_index('date', inplace=True)
-        data = pd.merge(data, df[[col + '_dans', 'depuis_' + col]], on='date')
-    
+    dfs = pd.date_range(start, end, freq="D").to_frame(index=False, name="date")
+
+    # flag each calendar day for every kind of event
+    columns = list(CALENDARS)
+    flags = pd.DataFrame(index=dfs['date'])
+    for col in columns:
+        event = events.loc[events[col] != 0, 'date'].drop_duplicates()
+
+        # an event is a single day interval, flag them with a binary search
+        flags[col] = in_intervals(dfs['date'], event, event)
+
+    # days until the next event and since the latest one, for all events in a single pass
+    df = proximity_features(flags)
+    data = pd.merge(data, df, on='date')
+
     return data
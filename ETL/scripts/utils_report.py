@@ -0,0 +1,177 @@
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+from scripts.utils_dtypes import memory_mb
+
+
+# machine readable report of the last run, written next to the datawarehouse
+REPORT_PATH = 'data/etl_report.json'
+
+# metrics compared between two runs
+COMPARED_METRICS = ['wall_time', 'cpu_time', 'peak_rss_mb', 'rss_increase_mb', 'tracemalloc_peak_mb', 'output_mb',
+                    'rows_out']
+
+# interval at which the resident memory of the process is sampled while a stage runs
+RSS_SAMPLE_SECONDS = 0.01
+
+
+def count_rows(value):
+    """ number of rows of a stage input or output: dataframes length or a returned row count """
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+
+    return None
+
+
+def _max_rss_mb():
+    # high-water mark of the resident memory of the current process, linux reports it in KiB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _rss_mb():
+    # current resident memory of the process, the high-water mark where /proc is missing
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return _max_rss_mb()
+
+
+class _RssSampler:
+    """
+    peak resident memory of the process while a stage runs: a worker process is reused across
+    stages, so its lifetime high-water mark only tells about the stage that set it, the memory
+    is sampled in a background thread instead, and the high-water mark is used when it moved
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, _rss_mb())
+
+    def __enter__(self):
+        self.baseline = self.peak = _rss_mb()
+        self._high_water_mark = _max_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_mb())
+
+        # a new high-water mark of the process was set during the stage, it is its exact peak
+        high_water_mark = _max_rss_mb()
+        if high_water_mark > self._high_water_mark:
+            self.peak = max(self.peak, high_water_mark)
+
+
+def measure(func, trace_memory=False, **kwargs):
+    """
+    call func(**kwargs) and return its result along with its metrics:
+    wall and cpu times, peak resident memory of the process during the call and its increase
+    over the memory held when the call started,
+    peak of the memory allocated during the call when traced, rows in and out
+    and memory held by the inputs and the output dataframes
+    """
+
+    rows_in = [rows for rows in map(count_rows, kwargs.values()) if rows is not None]
+    inputs_mb = [mb for mb in map(memory_mb, kwargs.values()) if mb is not None]
+    if trace_memory:
+        tracemalloc.start()
+
+    with _RssSampler() as rss:
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = func(**kwargs)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    metrics = {
+        'wall_time': round(wall, 4),
+        'cpu_time': round(cpu, 4),
+        'peak_rss_mb': round(rss.peak, 1),
+        'rss_increase_mb': round(rss.peak - rss.baseline, 1),
+        'tracemalloc_peak_mb': round(traced_peak, 1) if traced_peak is not None else None,
+        'rows_in': sum(rows_in) if rows_in else None,
+        'rows_out': count_rows(result),
+        'inputs_mb': round(sum(inputs_mb), 2) if inputs_mb else None,
+        'output_mb': round(memory_mb(result), 2) if memory_mb(result) is not None else None,
+        'pid': os.getpid(),
+    }
+
+    return result, metrics
+
+
+def write_report(stages, params, started, path=REPORT_PATH):
+    """ write the run report, the report of the previous run is kept aside for comparisons """
+
+    report = {
+        'started': started.isoformat(timespec='seconds'),
+        'finished': datetime.now().isoformat(timespec='seconds'),
+        'wall_time': round((datetime.now() - started).total_seconds(), 4),
+        'params': {key: str(value) if value is not None else None for key, value in params.items()},
+        'stages': stages,
+    }
+
+    if os.path.exists(path):
+        os.replace(path, previous_report_path(path))
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return report
+
+
+def previous_report_path(path=REPORT_PATH):
+    root, ext = os.path.splitext(path)
+    return root + '.previous' + ext
+
+
+def read_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_reports(report, previous):
+    """
+    compare two run reports stage by stage, as a dataframe indexed by stage with
+    the current value, the previous one and their ratio for every compared metric
+    """
+
+    rows = {}
+    for stage in list(report['stages']) + [s for s in previous['stages'] if s not in report['stages']]:
+        current_metrics = report['stages'].get(stage, {})
+        previous_metrics = previous['stages'].get(stage, {})
+        row = {}
+        for metric in COMPARED_METRICS:
+            current_value, previous_value = current_metrics.get(metric), previous_metrics.get(metric)
+            row[(metric, 'current')] = current_value
+            row[(metric, 'previous')] = previous_value
+            row[(metric, 'ratio')] = (round(current_value / previous_value, 2)
+                                      if current_value is not None and previous_value else None)
+        rows[stage] = row
+
+    comparison = pd.DataFrame.from_dict(rows, orient='index')
+    comparison.columns = pd.MultiIndex.from_tuples(comparison.columns)
+    comparison.loc['total', ('wall_time', 'current')] = report['wall_time']
+    comparison.loc['total', ('wall_time', 'previous')] = previous['wall_time']
+    comparison.loc['total', ('wall_time', 'ratio')] = round(report['wall_time'] / previous['wall_time'], 2)
+
+    return comparison.dropna(axis=1, how='all')
@@ -1,12 +1,18 @@
 import numpy as np
 import pandas as pd 
+import pyarrow.parquet as pq
 import sqlite3 as sql
 from sqlalchemy import *
 
+from scripts.utils_religion_features import event_columns, proximity_columns
+
 
 ########################## Storing main dataframe into a staging db ############################
 # this allows data to be persisted more reliably than in multiple CSVs
 
+# rows inserted at once in the staging db
+BATCH_ROWS = 100000
+
 def main():
     # create a connector to the db
     staging_db = create_engine('sqlite:///data/staging_db.db')
@@ -14,8 +20,9 @@ def main():
     # drop table if exist
     conn = staging_db.raw_connection()
     cursor = conn.cursor()
-    command = "DROP TABLE IF EXISTS {};".format('frequentation')
-    cursor.execute(command)
+    for table in ['frequentation', 'calendrier']:
+        command = "DROP TABLE IF EXISTS {};".format(table)
+        cursor.execute(command)
     conn.commit()
     cursor.close()
 
@@ -36,18 +43,8 @@ def main():
                             Column('depuis_vacances', Integer),
                             Column('ferie_dans', Integer),
                             Column('depuis_ferie', Integer),
-                            Column('chretiennes_dans', Integer),
-                            Column('depuis_chretiennes', Integer),
-                            Column('juives_dans', Integer),
-                            Column('depuis_juives', Integer),
-                            Column('ramadan_dans', Integer),
-                            Column('depuis_ramadan', Integer),
-                            Column('musulmanes_dans', Integer),
-                            Column('depuis_musulmanes', Integer),
-                            Column('chretiennes', Integer),
-                            Column('juives', Integer),
-                            Column('ramadan', Integer),
-                            Column('musulmanes', Integer),
+                            # the features and the flag of each religious calendar
+                            *[Column(col, Integer) for col in [*proximity_columns(), *event_columns()]],
                             Column('greve', Integer),
                             Column('Quartier_detail', String(50)),
                             Column('prix_Quartier_detail_m2_appart', Float),
@@ -60,12 +57,33 @@ def main():
 
     frequentation.create(staging_db)
 
-    # store data in the sql table 
-    data = pd.read_csv('data/data.csv')
-    data.to_sql('frequentation', staging_db, if_exists='append')
+    # calendar features of every day of the history and of the horizon ahead
+    calendrier = Table('calendrier', meta,
+                        Column('date', Date, primary_key=True),
+                        Column('annee_scolaire', String(30)),
+                        *[Column(col, Integer) for col in ['vacances_dans', 'depuis_vacances', 'ferie_dans', 'depuis_ferie',
+                                                           *proximity_columns(), *event_columns(), 'greve']]
+                        )
+
+    calendrier.create(staging_db)
+
+    # store data in the sql table, by batches of rows so that memory stays bounded whatever the size
+    # of the row groups, the typed columnar file is read without any text parsing
+    data_file = pq.ParquetFile('data/data.parquet')
+    offset = 0
+    for batch in data_file.iter_batches(batch_size=BATCH_ROWS):
+        data = batch.to_pandas()
+        data.index += offset
+        data.to_sql('frequentation', staging_db, if_exists='append')
+        offset += len(data)
+
+    calendar = pd.read_parquet('data/calendar.parquet')
+    calendar.to_sql('calendrier', staging_db, if_exists='append', index=False)
 
     print('Data loaded in staging database.')
 
+    return offset
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
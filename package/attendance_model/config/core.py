@@ -11,6 +11,7 @@ PACKAGE_ROOT = Path(attendance_model.__file__).resolve().parent
 ROOT = PACKAGE_ROOT.parent
 CONFIG_FILE_PATH = PACKAGE_ROOT / "config.yml"
 DATASET_DIR = PACKAGE_ROOT / "datasets"
+DATASET_CACHE_DIR = DATASET_DIR / "cache"
 TRAINED_MODEL_DIR = PACKAGE_ROOT / "trained_models"
 
 
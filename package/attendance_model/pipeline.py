@@ -47,3 +47,19 @@ freq_pipeline = Pipeline(
         ),
     ]
 )
+
+
+def set_owned_input(pipeline: Pipeline, owned: bool = True) -> Pipeline:
+    """
+    Let the steps of the pipeline modify the frame they receive instead of copying it,
+    for callers handing over a frame they don't use afterwards.
+    """
+
+    pipeline.set_params(
+        **{
+            f"{name}__copy": not owned
+            for name, step in pipeline.steps
+            if "copy" in step.get_params()
+        }
+    )
+    return pipeline
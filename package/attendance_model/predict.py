@@ -6,11 +6,13 @@ from sklearn.metrics import mean_squared_error, mean_absolute_error, median_abso
 
 from attendance_model import __version__ as _version
 from attendance_model.config.core import config
+from attendance_model.pipeline import set_owned_input
 from attendance_model.processing.data_manager import load_pipeline
 from attendance_model.processing.validation import validate_inputs
 
 pipeline_file_name = f"{config.app_config.pipeline_save_file}{_version}.pkl"
-_freq_pipeline = load_pipeline(file_name=pipeline_file_name)
+# the validated inputs are a copy of the request, the steps can modify them
+_freq_pipeline = set_owned_input(load_pipeline(file_name=pipeline_file_name))
 
 
 def make_prediction(
@@ -1,77 +1,457 @@
+import hashlib
+import json
 import os
+import shutil
 import sqlite3 as sql
+import tempfile
 import typing as t
+from pathlib import Path
 
 import joblib
+import numpy as np
 import pandas as pd
 from sklearn.pipeline import Pipeline
 
 from attendance_model import __version__ as _version
-from attendance_model.config.core import DATASET_DIR, TRAINED_MODEL_DIR, config
+from attendance_model.config.core import (
+    DATASET_CACHE_DIR,
+    DATASET_DIR,
+    TRAINED_MODEL_DIR,
+    config,
+)
 
 
-def load_dataset(*, file_name: str) -> pd.DataFrame:
-    """Load the necessary data from the datawarehouse."""
+# warehouse columns that can be loaded, with the table holding them
+WAREHOUSE_COLUMNS = {
+    "date": "Frequentation_quotidienne",
+    "prevision": "Frequentation_quotidienne",
+    "reel": "Frequentation_quotidienne",
+    "cantine_nom": "Dim_site",
+    "annee_scolaire": "Dim_site",
+    "effectif": "Dim_site",
+    "quartier_detail": "Dim_site",
+    "prix_quartier_detail_m2_appart": "Dim_site",
+    "prix_moyen_m2_appartement": "Dim_site",
+    "prix_moyen_m2_maison": "Dim_site",
+    "longitude": "Dim_site",
+    "latitude": "Dim_site",
+    "depuis_vacances": "Dim_temporelle",
+    "depuis_ferie": "Dim_temporelle",
+    "depuis_juives": "Dim_temporelle",
+    "ramadan_dans": "Dim_temporelle",
+    "depuis_ramadan": "Dim_temporelle",
+    "greve": "Dim_evenement",
+    "plats": "Dim_menu",
+}
+
+# columns loaded when none are requested
+DEFAULT_COLUMNS = [column for column in WAREHOUSE_COLUMNS if column != "plats"]
+
+# training set materialized by the ETL: the days with a known attendance, denormalized
+# with the warehouse columns and flagged as strikes or outliers
+TRAINING_TABLE = "Entrainement"
+TRAINING_CONDITIONS = [
+    f"{TRAINING_TABLE}.greve is not 1",
+    f"{TRAINING_TABLE}.upper_outlier = 0",
+    f"{TRAINING_TABLE}.lower_outlier = 0",
+]
+
+# columns of the training set, strikes being left out of it
+TRAINING_COLUMNS = [column for column in DEFAULT_COLUMNS if column != "greve"]
+
+# join of each dimension to the fact table, only done when one of its columns is needed
+DIMENSION_JOINS = {
+    "Dim_site": (
+        "left join Dim_site"
+        " on Frequentation_quotidienne.site_id = Dim_site.site_id"
+    ),
+    "Dim_temporelle": (
+        "left join Dim_temporelle"
+        " on Frequentation_quotidienne.jour_id = Dim_temporelle.jour_id"
+    ),
+    "Dim_evenement": (
+        "left join Dim_evenement"
+        " on Frequentation_quotidienne.jour_id = Dim_evenement.jour_id"
+    ),
+    "Dim_menu": (
+        "left join Dim_menu"
+        " on Frequentation_quotidienne.jour_id = Dim_menu.jour_id"
+    ),
+}
+
+# dates are stored as text in the warehouse, bounds are compared in the same format
+WAREHOUSE_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# text columns read as categoricals, with the categories of their dimension table,
+# the other text columns stay python strings and any other column is a float
+DATE_COLUMNS = {"date"}
+CATEGORICAL_COLUMNS = {"cantine_nom", "annee_scolaire", "quartier_detail"}
+TEXT_COLUMNS = CATEGORICAL_COLUMNS | {"plats"}
+
+# rows fetched from the warehouse at once by the streaming reader
+BATCH_SIZE = 50_000
+
+# loaded datasets are cached on disk, the least recently used ones are evicted
+# above that size, the version changes with the layout of the cached files
+DATASET_CACHE_MAX_BYTES = 1024 * 2 ** 20
+DATASET_CACHE_VERSION = 1
+
+# pipeline step whose statistics can be refreshed after the training,
+# they are saved next to the pipeline with that suffix
+STATISTICS_STEP = "statistical_features"
+STATISTICS_SUFFIX = "_statistics"
+
+
+def _qualified(column: str, training: bool = False) -> str:
+    if training:
+        if column not in DEFAULT_COLUMNS:
+            raise ValueError(f"{column} is not a column of the training table")
+        return f"{TRAINING_TABLE}.{column}"
+    if column not in WAREHOUSE_COLUMNS:
+        raise ValueError(f"{column} is not a column of the datawarehouse")
+    return f"{WAREHOUSE_COLUMNS[column]}.{column}"
+
+
+def build_query(
+    *,
+    columns: t.Optional[t.List[str]] = None,
+    start_date: t.Optional[t.Any] = None,
+    end_date: t.Optional[t.Any] = None,
+    site_ids: t.Optional[t.List[int]] = None,
+    exclude: t.Optional[t.Dict[str, t.Any]] = None,
+    not_null: t.Optional[t.List[str]] = None,
+    training: bool = False,
+) -> t.Tuple[str, t.List[t.Any]]:
+    """
+    Compile the requested columns and filters into a parameterized query,
+    only joining the dimensions holding a requested or filtered column.
+    The training set is read from its materialized table, without any join.
+    """
+
+    if columns is None:
+        columns = TRAINING_COLUMNS if training else DEFAULT_COLUMNS
+    columns = list(columns)
+    exclude = exclude or {}
+    not_null = not_null or []
+    fact = TRAINING_TABLE if training else "Frequentation_quotidienne"
+    selected = ", ".join(_qualified(column, training) for column in columns)
+
+    conditions: t.List[str] = list(TRAINING_CONDITIONS) if training else []
+    params: t.List[t.Any] = []
+
+    # the date and site indexes of the fact table serve the date range
+    if start_date is not None:
+        conditions.append(f"{fact}.date >= ?")
+        params.append(pd.Timestamp(start_date).strftime(WAREHOUSE_DATE_FORMAT))
+    if end_date is not None:
+        conditions.append(f"{fact}.date < ?")
+        params.append(pd.Timestamp(end_date).strftime(WAREHOUSE_DATE_FORMAT))
+
+    # sites are given by their ids so that the fact table is searched on its site
+    # index, knowing how many of them there are, rather than through the left join
+    if site_ids is not None:
+        conditions.append(f"{fact}.site_id in ({', '.join('?' * len(site_ids))})")
+        params.extend(site_ids)
+
+    # "is not" keeps the missing values, as pandas does with !=
+    for column, values in exclude.items():
+        values = values if isinstance(values, (list, tuple, set)) else [values]
+        for value in values:
+            conditions.append(f"{_qualified(column, training)} is not ?")
+            params.append(value)
+
+    for column in not_null:
+        conditions.append(f"{_qualified(column, training)} is not null")
+
+    # the training table holds every column, the dimensions are only joined otherwise
+    tables = set()
+    if not training:
+        filtered = list(exclude) + list(not_null)
+        tables = {WAREHOUSE_COLUMNS[column] for column in columns + filtered}
+
+    query = f"select {selected}\nfrom {fact}"
+    for table, join in DIMENSION_JOINS.items():
+        if table in tables:
+            query += f"\n{join}"
+    if conditions:
+        query += "\nwhere " + "\n  and ".join(conditions)
+    query += f"\norder by {fact}.jour_site_id"
+
+    return query, params
+
+
+def _categories(
+    conn: sql.Connection, columns: t.List[str]
+) -> t.Dict[str, pd.CategoricalDtype]:
+    # categories are fixed upfront so that every batch shares the same dtype
+    dtypes = {}
+    for column in columns:
+        if column in CATEGORICAL_COLUMNS:
+            values = conn.execute(
+                f"select distinct {column} from {WAREHOUSE_COLUMNS[column]} "
+                f"where {column} is not null order by {column}"
+            ).fetchall()
+            dtypes[column] = pd.CategoricalDtype([value for value, in values])
+    return dtypes
+
+
+def _site_ids(conn: sql.Connection, canteens: t.List[str]) -> t.List[int]:
+    # every school year of a canteen is a site of its own
+    rows = conn.execute(
+        "select site_id from Dim_site "
+        f"where cantine_nom in ({', '.join('?' * len(canteens))}) order by site_id",
+        list(canteens),
+    ).fetchall()
+    return [site_id for site_id, in rows]
+
+
+def _typed_column(
+    values: t.Sequence[t.Any], column: str, dtype: t.Optional[pd.CategoricalDtype]
+) -> t.Union[np.ndarray, pd.Categorical]:
+    if column in DATE_COLUMNS:
+        # a batch only holds a few distinct dates, each of them is parsed once
+        codes, uniques = pd.factorize(np.array(values, dtype=object))
+        dates = pd.to_datetime(uniques, format=WAREHOUSE_DATE_FORMAT).to_numpy()
+        return np.append(dates, np.datetime64("NaT"))[codes]
+    if dtype is not None:
+        return pd.Categorical(values, dtype=dtype)
+    if column in TEXT_COLUMNS:
+        return np.array(values, dtype=object)
+    # missing values are read as None, which numpy turns into nan
+    return np.array(values, dtype=np.float64)
+
+
+def _typed_batch(
+    rows: t.List[t.Tuple[t.Any, ...]],
+    columns: t.List[str],
+    dtypes: t.Dict[str, pd.CategoricalDtype],
+) -> t.Dict[str, t.Union[np.ndarray, pd.Categorical]]:
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return {
+        column: _typed_column(column_values, column, dtypes.get(column))
+        for column, column_values in zip(columns, values)
+    }
+
+
+def _concat_column(
+    arrays: t.List[t.Union[np.ndarray, pd.Categorical]]
+) -> t.Union[np.ndarray, pd.Categorical]:
+    if isinstance(arrays[0], pd.Categorical):
+        # batches share their categories, their codes are simply put end to end
+        categoricals = t.cast(t.List[pd.Categorical], arrays)
+        codes = np.concatenate([array.codes for array in categoricals])
+        return pd.Categorical.from_codes(codes, dtype=categoricals[0].dtype)
+    return np.concatenate(arrays)
+
+
+def iter_columns(
+    *,
+    file_name: str,
+    columns: t.Optional[t.List[str]] = None,
+    batch_size: int = BATCH_SIZE,
+    categorical: bool = True,
+    canteens: t.Optional[t.List[str]] = None,
+    training: bool = False,
+    **filters: t.Any,
+) -> t.Iterator[t.Dict[str, t.Union[np.ndarray, pd.Categorical]]]:
+    """
+    Stream the datawarehouse as typed column batches of at most batch_size rows.
+
+    Each batch maps the columns to arrays built from the fetched rows: dates as
+    datetime64, numbers as float64 (nan when missing) and the canteen, school
+    year and district as categoricals sharing the same categories across
+    batches, or as strings when categorical is False. The filters are the ones
+    of load_dataset, a result without rows yields a single empty batch.
+    """
+
+    if columns is None:
+        columns = TRAINING_COLUMNS if training else DEFAULT_COLUMNS
+    columns = list(columns)
 
     conn = sql.connect(os.path.join(DATASET_DIR / file_name))
+    try:
+        site_ids = _site_ids(conn, canteens) if canteens is not None else None
+        query, params = build_query(
+            columns=columns, site_ids=site_ids, training=training, **filters
+        )
+        dtypes = _categories(conn, columns) if categorical else {}
+        cursor = conn.execute(query, params)
+
+        rows = cursor.fetchmany(batch_size)
+        yield _typed_batch(rows, columns, dtypes)
+        while len(rows) == batch_size:
+            rows = cursor.fetchmany(batch_size)
+            if rows:
+                yield _typed_batch(rows, columns, dtypes)
+    finally:
+        conn.close()
+
+
+def iter_dataset(**kwargs: t.Any) -> t.Iterator[pd.DataFrame]:
+    """Stream the datawarehouse as dataframes, see iter_columns for the arguments."""
+
+    for batch in iter_columns(**kwargs):
+        yield pd.DataFrame(batch)
+
+
+def _dataset_key(db_path: Path, **arguments: t.Any) -> str:
+    # the warehouse state is its size and modification time, a rebuild or an
+    # incremental run changes the key and the stale entries are evicted in time
+    stat = os.stat(db_path)
+    for bound in ("start_date", "end_date"):
+        if arguments[bound] is not None:
+            arguments[bound] = str(pd.Timestamp(arguments[bound]))
+    parts = [
+        DATASET_CACHE_VERSION,
+        str(Path(db_path).resolve()),
+        stat.st_size,
+        stat.st_mtime_ns,
+        sorted(arguments.items()),
+    ]
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def _store_dataset(entry: Path, dataframe: pd.DataFrame) -> None:
+    # one numpy file per column, text is stored as codes and the values they stand for
+    tmp = Path(tempfile.mkdtemp(dir=entry.parent, prefix=".tmp-"))
+    columns = []
+    for i, column in enumerate(dataframe.columns):
+        values = dataframe[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            array = values.cat.codes.to_numpy()
+            columns.append({"name": column, "categories": list(values.cat.categories)})
+        elif values.dtype == object:
+            array, uniques = pd.factorize(values)
+            columns.append({"name": column, "values": list(uniques)})
+        else:
+            array = values.to_numpy()
+            columns.append({"name": column})
+        np.save(tmp / f"{i}.npy", array)
+    (tmp / "columns.json").write_text(json.dumps(columns))
+
+    # renamed once complete, so that a reader never sees a partial entry
+    try:
+        os.replace(tmp, entry)
+    except OSError:
+        # stored in the meantime by another process
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _load_cached_dataset(entry: Path) -> t.Optional[pd.DataFrame]:
+    try:
+        columns = json.loads((entry / "columns.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+    # columns are read whole: the dataframe owns them and can be modified in place
+    data = {}
+    for i, column in enumerate(columns):
+        array = np.load(entry / f"{i}.npy")
+        if "categories" in column:
+            data[column["name"]] = pd.Categorical.from_codes(
+                array, categories=column["categories"]
+            )
+        elif "values" in column:
+            values = np.array(column["values"] + [None], dtype=object)
+            data[column["name"]] = values[array]
+        else:
+            data[column["name"]] = array
+
+    # a hit makes the entry the most recently used one
+    os.utime(entry)
+    return pd.DataFrame(data, copy=False)
+
+
+def _evict_datasets(cache_dir: Path, max_bytes: int) -> None:
+    entries = []
+    for entry in cache_dir.iterdir():
+        if entry.is_dir() and not entry.name.startswith("."):
+            size = sum(path.stat().st_size for path in entry.iterdir())
+            entries.append((entry.stat().st_mtime, size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def load_dataset(
+    *,
+    file_name: str,
+    columns: t.Optional[t.List[str]] = None,
+    start_date: t.Optional[t.Any] = None,
+    end_date: t.Optional[t.Any] = None,
+    canteens: t.Optional[t.List[str]] = None,
+    exclude: t.Optional[t.Dict[str, t.Any]] = None,
+    not_null: t.Optional[t.List[str]] = None,
+    categorical: bool = False,
+    batch_size: int = BATCH_SIZE,
+    training: bool = False,
+    cache_dir: t.Optional[Path] = DATASET_CACHE_DIR,
+) -> pd.DataFrame:
+    """
+    Load the necessary data from the datawarehouse.
+
+    Filters are run by SQLite so that only the needed rows and columns are read:
+    dates within [start_date, end_date), the given canteens, rows where a column
+    equals one of the excluded values are dropped and so are rows where a
+    not_null column is missing. The rows are read in typed column batches put
+    end to end, text columns stay strings unless categorical as the pipeline
+    groups and encodes them by value.
+
+    With training, the training set materialized by the ETL is read in a single
+    scan: the days with a known attendance, strikes and outliers left out.
+
+    Loaded datasets are cached in cache_dir, keyed by the state of the warehouse
+    file and the arguments, so that loading them again is a read of their column
+    files. A cache_dir of None always reads the warehouse.
+    """
 
-    SQL_Query = pd.read_sql_query(
-        """select
-    Frequentation_quotidienne.date,
-    Frequentation_quotidienne.prevision,
-    Frequentation_quotidienne.reel,
-    Dim_site.cantine_nom,
-    Dim_site.annee_scolaire,
-    Dim_site.effectif,
-    Dim_site.quartier_detail,
-    Dim_site.prix_quartier_detail_m2_appart,
-    Dim_site.prix_moyen_m2_appartement,
-    Dim_site.prix_moyen_m2_maison,
-    Dim_site.longitude,
-    Dim_site.latitude,
-    Dim_temporelle.depuis_vacances,
-    Dim_temporelle.depuis_ferie,
-    Dim_temporelle.depuis_juives,
-    Dim_temporelle.ramadan_dans,
-    Dim_temporelle.depuis_ramadan,
-    Dim_evenement.greve
-
-    from Frequentation_quotidienne
-
-    left join Dim_site               on Frequentation_quotidienne.site_id = Dim_site.site_id
-    left join Dim_menu               on Frequentation_quotidienne.jour_id = Dim_menu.jour_id
-    left join Dim_temporelle         on Frequentation_quotidienne.jour_id = Dim_temporelle.jour_id
-    left join Dim_evenement          on Frequentation_quotidienne.jour_id = Dim_evenement.jour_id
-
-    order by Frequentation_quotidienne.jour_site_id
-    """,
-        conn,
+    arguments = dict(
+        columns=columns,
+        start_date=start_date,
+        end_date=end_date,
+        canteens=canteens,
+        exclude=exclude,
+        not_null=not_null,
+        categorical=categorical,
+        training=training,
+    )
+    if cache_dir is not None:
+        entry = Path(cache_dir) / _dataset_key(DATASET_DIR / file_name, **arguments)
+        cached = _load_cached_dataset(entry)
+        if cached is not None:
+            return cached
+
+    batches = list(
+        iter_columns(
+            file_name=file_name,
+            columns=columns,
+            batch_size=batch_size,
+            categorical=categorical,
+            canteens=canteens,
+            training=training,
+            start_date=start_date,
+            end_date=end_date,
+            exclude=exclude,
+            not_null=not_null,
+        )
     )
 
     dataframe = pd.DataFrame(
-        SQL_Query,
-        columns=[
-            "date",
-            "prevision",
-            "reel",
-            "cantine_nom",
-            "annee_scolaire",
-            "effectif",
-            "quartier_detail",
-            "prix_quartier_detail_m2_appart",
-            "prix_moyen_m2_appartement",
-            "prix_moyen_m2_maison",
-            "longitude",
-            "latitude",
-            "depuis_vacances",
-            "depuis_ferie",
-            "depuis_juives",
-            "ramadan_dans",
-            "depuis_ramadan",
-            "greve",
-        ],
+        {
+            column: _concat_column([batch[column] for batch in batches])
+            for column in batches[0]
+        }
     )
 
+    if cache_dir is not None:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        _store_dataset(entry, dataframe)
+        _evict_datasets(Path(cache_dir), DATASET_CACHE_MAX_BYTES)
+
     return dataframe
 
 
@@ -89,11 +469,36 @@ def save_pipeline(*, pipeline_to_persist: Pipeline) -> None:
     joblib.dump(pipeline_to_persist, save_path)
 
 
+def _statistics_file_name(file_name: str) -> str:
+    path = Path(file_name)
+    return f"{path.stem}{STATISTICS_SUFFIX}{path.suffix}"
+
+
+def save_statistics(*, pipeline_to_persist: Pipeline) -> None:
+    """
+    Saves the refreshed statistics of the versioned model next to it,
+    the model itself is left as trained.
+    """
+
+    save_file_name = f"{config.app_config.pipeline_save_file}{_version}.pkl"
+    save_path = TRAINED_MODEL_DIR / _statistics_file_name(save_file_name)
+
+    joblib.dump(pipeline_to_persist.named_steps[STATISTICS_STEP], save_path)
+
+
 def load_pipeline(*, file_name: str) -> Pipeline:
-    """Load a persisted pipeline."""
+    """Load a persisted pipeline, with its refreshed statistics if any."""
 
     file_path = TRAINED_MODEL_DIR / file_name
     trained_model = joblib.load(filename=file_path)
+
+    # the statistics refreshed since the training replace the trained ones,
+    # saving the pipeline again removes them
+    statistics_path = TRAINED_MODEL_DIR / _statistics_file_name(file_name)
+    if statistics_path.exists():
+        statistics = joblib.load(filename=statistics_path)
+        trained_model.set_params(**{STATISTICS_STEP: statistics})
+
     return trained_model
 
 
@@ -4,18 +4,73 @@ import numpy as np
 import pandas as pd
 from sklearn.base import BaseEstimator, TransformerMixin
 
-from ..config.core import config
+from .outliers import merge_moments
+
+
+# fixed period of the day of week features, the one of the day of year features
+# is the number of days of the year of the date
+DAYS_IN_WEEK = 7
+
+
+def date_features(dates: pd.Series) -> pd.DataFrame:
+    """
+    Parsed dates and date based features, computed once per unique date
+    and broadcast to the rows
+    """
+
+    codes, uniques = pd.factorize(dates)
+    uniques = pd.DatetimeIndex(pd.to_datetime(uniques))
+    if (codes == -1).any():
+        # missing dates are coded -1, which takes the features of a trailing NaT
+        uniques = uniques.append(pd.DatetimeIndex([pd.NaT]))
+
+    day_of_week = 2 * np.pi * uniques.dayofweek / DAYS_IN_WEEK
+    day_of_year = 2 * np.pi * uniques.dayofyear / (365 + uniques.is_leap_year)
+    features = pd.DataFrame(
+        {
+            "date": uniques,
+            "year": uniques.year,
+            "day_of_week_sin": np.sin(day_of_week),
+            "day_of_year_sin": np.sin(day_of_year),
+            "day_of_year_cos": np.cos(day_of_year),
+            "week": uniques.isocalendar()["week"].array,
+        }
+    )
+
+    return features.take(codes)
 
 
 class DatetimeVariableEstimator(BaseEstimator, TransformerMixin):
-    """Derived features from date"""
+    """
+    Derived features from date
 
-    def __init__(self, date_variable: str):
+    Version 2 uses fixed periods, so a date gets the same features in any batch.
+    Version 1 divided by the maxima of the batch, it is kept for the pipelines
+    persisted before version 2, which are loaded as version 1 until retrained.
+
+    The transformers of this module copy their input unless copy is False,
+    when the frame they receive is owned by the pipeline and can be modified.
+    """
+
+    VERSIONS = [1, 2]
+
+    def __init__(self, date_variable: str, version: int = 2, copy: bool = True):
 
         if not isinstance(date_variable, str):
             raise ValueError("date_variable should be a string of format 'yyyy-mm-dd' ")
 
+        if version not in self.VERSIONS:
+            raise ValueError(f"version should be one of {self.VERSIONS}")
+
         self.date_variable = date_variable
+        self.version = version
+        self.copy = copy
+
+    def __setstate__(self, state):
+        # estimators pickled without a version computed the version 1 features
+        state.setdefault("version", 1)
+        state.setdefault("copy", True)
+        super().__setstate__(state)
 
     def fit(self, X: pd.DataFrame, y: pd.Series = None):
         # we need this step to fit the sklearn pipeline
@@ -23,8 +78,27 @@ class DatetimeVariableEstimator(BaseEstimator, TransformerMixin):
 
     def transform(self, X: pd.DataFrame) -> pd.DataFrame:
 
+        if self.version == 1:
+            return self._transform_v1(X)
+
         # so that we do not over-write the original dataframe
-        X = X.copy()
+        if self.copy:
+            X = X.copy()
+
+        # creating date based features
+        features = date_features(X[self.date_variable])
+        X[self.date_variable] = features.pop("date").array
+        for name in features.columns:
+            X[name] = features[name].array
+        X.set_index("date", inplace=True)
+
+        return X
+
+    def _transform_v1(self, X: pd.DataFrame) -> pd.DataFrame:
+
+        # so that we do not over-write the original dataframe
+        if self.copy:
+            X = X.copy()
         X[self.date_variable] = pd.to_datetime(X[self.date_variable])
 
         # creating date based features
@@ -53,10 +127,28 @@ class DatetimeVariableEstimator(BaseEstimator, TransformerMixin):
         return X
 
 
+# iso weeks are numbered from 1 to 53, week 0 holds the missing weeks
+N_WEEKS = 54
+
+
+def category_codes(values: pd.Series, categories: np.ndarray) -> np.ndarray:
+    """Codes of the values among the categories, -1 for the unknown or missing ones."""
+
+    return pd.Categorical(values, categories=categories).codes
+
+
 class StatisticalVariableEstimator(BaseEstimator, TransformerMixin):
-    """Derived statistical features"""
+    """
+    Derived statistical features
+
+    The statistics of a canteen and week are compiled into an array indexed
+    by canteen code and week, with a trailing canteen of missing values for
+    the unknown canteens, so that transform is a single gather.
+    """
+
+    features = ["freq_reel_%", "freq_reel_%_std"]
 
-    def __init__(self, prevision: str, effectif: str):
+    def __init__(self, prevision: str, effectif: str, copy: bool = True):
 
         if not isinstance(prevision, str):
             raise ValueError("prevision should be a string")
@@ -64,64 +156,99 @@ class StatisticalVariableEstimator(BaseEstimator, TransformerMixin):
         if not isinstance(effectif, str):
             raise ValueError("effectif should be a string")
 
-        # while concatenating X and y, y column gets rename 0
-        self.reel = config.model_config.target
         self.prevision = prevision
         self.effectif = effectif
+        self.copy = copy
+
+    def __setstate__(self, state):
+        # estimators pickled before the arrays held the training target
+        # and the statistics as dataframes, they are compiled when loaded
+        y = state.pop("y", None)
+        agg_mean, agg_std = state.pop("agg_mean", None), state.pop("agg_std", None)
+        state.setdefault("copy", True)
+        super().__setstate__(state)
+        if y is not None:
+            self._compile(pd.concat((agg_mean, agg_std), axis=1)[self.features])
 
     def fit(self, X: pd.DataFrame, y: pd.Series):
-        
+
         # to avoid data leakage we compute the relevant statistics on train set only
-        y.index = X.index
-        self.y = y
-
-        X = X.copy()
-        train = pd.concat((X, self.y), axis=1)
-
-        # aggregate data significantly (canteen, scholar year and week level) and compute statistics
-        train["freq_predicted_%"] = train[self.prevision] / train[self.effectif]
-        train["freq_reel_%"] = train[self.reel] / train[self.effectif]
-        grouped_train = train.groupby(["cantine_nom", "week", "annee_scolaire"])
-        grouped_train_m = (
-            grouped_train[["freq_predicted_%", "freq_reel_%", self.prevision, self.reel]]
-            .mean()
-            .reset_index()
-        )
-        grouped_train_s = (
-            grouped_train[["freq_predicted_%", "freq_reel_%", self.prevision, self.reel]]
-            .std()
-            .reset_index()
+        self.moments_, self.until_ = None, None
+        self._fold(X, y)
+
+        return self
+
+    def update(self, X: pd.DataFrame, y: pd.Series):
+        """
+        Fold new rows and their actual target into the statistics without refitting:
+        only the new rows are aggregated, then merged with the group statistics
+        """
+
+        if getattr(self, "moments_", None) is None:
+            raise ValueError(
+                "statistics persisted without their moments can't be updated, "
+                "the pipeline should be trained again"
+            )
+
+        self._fold(X, y)
+
+        return self
+
+    def _fold(self, X: pd.DataFrame, y: pd.Series) -> None:
+        # y is aligned on X by position
+        rows = X[["cantine_nom", "week", "annee_scolaire"]].assign(
+            **{"freq_reel_%": y.to_numpy() / X[self.effectif].to_numpy()}
         )
 
+        # aggregate data significantly (canteen, scholar year and week level): count,
+        # mean and sum of squared deviations, merged with the ones of the rows before
+        keys = ["cantine_nom", "week", "annee_scolaire"]
+        grouped = rows.groupby(keys, observed=True)["freq_reel_%"]
+        moments = pd.DataFrame({"count": grouped.count(), "mean": grouped.mean()})
+        moments["m2"] = grouped.var(ddof=0) * moments["count"]
+        moments = merge_moments(self.moments_, moments)
+        self.moments_ = moments
+
+        # the rows are indexed by date by DatetimeVariableEstimator,
+        # the statistics hold the ones up to until_
+        if isinstance(X.index, pd.DatetimeIndex) and len(X):
+            until = X.index.max()
+            self.until_ = until if self.until_ is None else max(self.until_, until)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.sqrt(moments["m2"] / (moments["count"] - 1))
+        yearly = pd.DataFrame({"freq_reel_%": moments["mean"], "freq_reel_%_std": std})
+
         # then we average on the years, to have a single number per canteen and week
         # in order to be able to spread it to the test set
-        agg_mean = grouped_train_m.groupby(["cantine_nom", "week"])
-        self.agg_mean = agg_mean[["freq_predicted_%", "freq_reel_%"]].mean()
-        agg_std = grouped_train_s.groupby(["cantine_nom", "week"])
-        self.agg_std = agg_std[["freq_predicted_%", "freq_reel_%"]].mean()
-
-        self.agg_std.rename(
-            columns={
-                "freq_predicted_%": "freq_predicted_%_std",
-                "freq_reel_%": "freq_reel_%_std",
-            },
-            inplace=True,
-        )
+        self._compile(yearly.groupby(level=["cantine_nom", "week"]).mean())
 
-        return self
+    def _compile(self, statistics: pd.DataFrame) -> None:
+        # statistics indexed by canteen and week into an array of
+        # shape (feature, canteen code, week)
+        canteens = statistics.index.get_level_values("cantine_nom")
+        weeks = statistics.index.get_level_values("week").to_numpy(dtype="int64")
 
-    def transform(self, X: pd.DataFrame) -> pd.DataFrame:
+        self.canteens_ = np.sort(canteens.unique().to_numpy(dtype=object))
+        codes = category_codes(canteens, self.canteens_)
 
-        X = X.merge(
-            self.agg_mean, left_on=["cantine_nom", "week"], right_index=True, how="left"
+        self.statistics_ = np.full(
+            (len(self.features), len(self.canteens_) + 1, N_WEEKS), np.nan
         )
+        self.statistics_[:, codes, weeks] = statistics[self.features].to_numpy().T
 
-        X = X.merge(
-            self.agg_std, left_on=["cantine_nom", "week"], right_index=True, how="left"
-        )
+    def transform(self, X: pd.DataFrame) -> pd.DataFrame:
+
+        codes = category_codes(X["cantine_nom"], self.canteens_)
+        weeks = X["week"].to_numpy(dtype="int64", na_value=0)
+        values = self.statistics_[:, codes, weeks]
 
-        X.drop(["freq_predicted_%", "freq_predicted_%_std"], axis=1, inplace=True)
-        X.reset_index(drop=True, inplace=True)
+        # the new columns are added to a shallow copy, no data is copied
+        if self.copy:
+            X = X.copy(deep=False)
+        for feature, column in zip(self.features, values):
+            X[feature] = column
+        X.index = pd.RangeIndex(len(X))
 
         return X
 
@@ -129,61 +256,98 @@ class StatisticalVariableEstimator(BaseEstimator, TransformerMixin):
 class NumericalImputer(BaseEstimator, TransformerMixin):
     """Numerical missing value imputer"""
 
-    def __init__(self, variables: List[str]):
+    def __init__(self, variables: List[str], copy: bool = True):
 
         if not isinstance(variables, list):
             raise ValueError("Variables should be in a list")
 
         self.variables = variables
+        self.copy = copy
+
+    def __setstate__(self, state):
+        state.setdefault("copy", True)
+        super().__setstate__(state)
 
     def fit(self, X, y: pd.Series = None):
         # persist median in a dictionary
-        self.imputer_dict_ = {}
-
-        for feature in self.variables:
-            self.imputer_dict_[feature] = X[feature].median()
+        self.imputer_dict_ = X[self.variables].median().to_dict()
         return self
 
     def transform(self, X):
 
-        X = X.copy()
-        for feature in self.variables:
-            X[feature].fillna(self.imputer_dict_[feature], inplace=True)
+        # impute the variables as a single float block
+        block = X[self.variables].to_numpy(dtype="float64")
+        missing = np.isnan(block)
+        medians = np.array([self.imputer_dict_[var] for var in self.variables])
+        np.copyto(block, medians, where=missing)
+
+        # only the columns with missing values are written back
+        if self.copy:
+            X = X.copy()
+        for i in np.flatnonzero(missing.any(axis=0)):
+            X[self.variables[i]] = block[:, i]
         return X
 
 
 class TargetEncoder(BaseEstimator, TransformerMixin):
-    """String to numbers categorical encoder."""
+    """
+    String to numbers categorical encoder.
+
+    The categories of a variable are stored in an array sorted by their mean target,
+    a category is encoded by its position, unknown and missing ones by unknown_value.
+    """
 
-    def __init__(self, variables: List[str]):
+    def __init__(
+        self, variables: List[str], unknown_value: float = np.nan, copy: bool = True
+    ):
 
         if not isinstance(variables, list):
             raise ValueError("Variables should be in a list")
 
         self.variables = variables
+        self.unknown_value = unknown_value
+        self.copy = copy
+
+    def __setstate__(self, state):
+        # encoders pickled before the arrays held the training target,
+        # and dictionaries from category to code
+        state.pop("y", None)
+        encoder_dict = state.pop("encoder_dict_", None)
+        state.setdefault("unknown_value", np.nan)
+        state.setdefault("copy", True)
+        super().__setstate__(state)
+        if encoder_dict is not None:
+            self.categories_ = {
+                var: np.array(sorted(codes, key=codes.get), dtype=object)
+                for var, codes in encoder_dict.items()
+            }
 
     def fit(self, X: pd.DataFrame, y: pd.Series):
-        
-        y.index = X.index
-        self.y = y
-
-        X = X.copy()
-        
-        temp = pd.concat((X, self.y), axis=1)
-        temp.columns = list(X.columns) + ["target"]
 
-        # persist enconding in dictionary
-        self.encoder_dict_ = {}
+        # y is aligned on X by position, neither of them is modified
+        target = pd.Series(y.to_numpy())
 
+        # persist the categories sorted by mean target
+        self.categories_ = {}
         for var in self.variables:
-            t = temp.groupby([var])["target"].mean().sort_values(ascending=True).index
-            self.encoder_dict_[var] = {k: i for i, k in enumerate(t, 0)}
+            means = target.groupby(X[var].to_numpy()).mean()
+            categories = means.sort_values(ascending=True).index
+            self.categories_[var] = categories.to_numpy(dtype=object)
 
         return self
 
     def transform(self, X):
 
-        X = X.copy()
-        for feature in self.variables:
-            X[feature] = X[feature].map(self.encoder_dict_[feature])
+        # codes of all the variables in a single float block
+        encoded = np.empty((len(X), len(self.variables)))
+        for i, var in enumerate(self.variables):
+            codes = category_codes(X[var], self.categories_[var])
+            encoded[:, i] = np.where(codes == -1, self.unknown_value, codes)
+
+        # the encoded columns replace the others in a shallow copy, pandas would write
+        # float columns over in place, the frame is copied when there are some
+        if self.copy:
+            X = X.copy(deep=any(X[var].dtype.kind == "f" for var in self.variables))
+        for var, column in zip(self.variables, encoded.T):
+            X[var] = column
         return X
@@ -0,0 +1,172 @@
+import typing as t
+
+import numpy as np
+import pandas as pd
+
+# groups whose statistics an attendance is compared with
+GROUPINGS = {
+    "canteen_year": ["cantine_nom", "annee_scolaire"],
+    "canteen_week": ["cantine_nom", "week"],
+}
+
+METHODS = ["zscore", "mad"]
+
+# scales the median absolute deviation to the std of a normal distribution
+MAD_SCALE = 1.4826
+
+
+class OutlierTagger:
+    """
+    Tag the values of a column further than n spreads from the center of their group:
+    mean and std with zscore, median and scaled median absolute deviation with mad.
+    Zeros are mostly mistakes, they are tagged but left out of the statistics.
+
+    fit_transform computes the statistics of a dataframe in a single groupby pass,
+    fit also accepts an iterable of chunks and transform tags any chunk, so that
+    a dataset streamed from the datawarehouse never has to be held whole.
+    """
+
+    def __init__(
+        self,
+        column: str,
+        *,
+        n: float = 2,
+        method: str = "zscore",
+        groups: str = "canteen_year",
+    ):
+
+        if method not in METHODS:
+            raise ValueError(f"method should be one of {METHODS}")
+
+        if groups not in GROUPINGS:
+            raise ValueError(f"groups should be one of {list(GROUPINGS)}")
+
+        self.column = column
+        self.n = n
+        self.method = method
+        self.groups = groups
+
+    def _keys(self, data: pd.DataFrame) -> t.List[pd.Series]:
+        keys = []
+        for key in GROUPINGS[self.groups]:
+            if key == "week" and key not in data.columns:
+                week = pd.to_datetime(data["date"]).dt.isocalendar().week
+                keys.append(week.astype("int64").rename(key))
+            else:
+                keys.append(data[key])
+        return keys
+
+    def _values(self, data: pd.DataFrame) -> pd.Series:
+        values = data[self.column]
+        return values.where(values != 0)
+
+    def _tag(
+        self, data: pd.DataFrame, center: np.ndarray, spread: np.ndarray
+    ) -> pd.DataFrame:
+        # shallow copy, the flags are added without copying the other columns
+        values = data[self.column].to_numpy()
+        tagged = data.copy(deep=False)
+        with np.errstate(invalid="ignore"):
+            tagged["upper_outlier"] = values > center + self.n * spread
+            tagged["lower_outlier"] = values < center - self.n * spread
+        return tagged
+
+    def fit_transform(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Tag a whole dataframe, its group statistics broadcast by transform."""
+
+        keys = self._keys(data)
+        values = self._values(data)
+        grouped = values.groupby(keys, observed=True)
+
+        if self.method == "zscore":
+            center = grouped.transform("mean")
+            spread = grouped.transform("std")
+        else:
+            center = grouped.transform("median")
+            deviation = (values - center).abs()
+            spread = deviation.groupby(keys, observed=True).transform("median")
+            spread = MAD_SCALE * spread
+
+        return self._tag(data, center.to_numpy(), spread.to_numpy())
+
+    def partial_fit(self, chunk: pd.DataFrame) -> "OutlierTagger":
+        """Add a chunk to the group statistics."""
+
+        values = self._values(chunk)
+        keys = [key[values.notnull()] for key in self._keys(chunk)]
+        values = values.dropna()
+
+        if self.method == "zscore":
+            # count, mean and sum of squared deviations of the chunk,
+            # merged with the ones of the previous chunks
+            grouped = values.groupby(keys, observed=True)
+            stats = pd.DataFrame({"count": grouped.count(), "mean": grouped.mean()})
+            stats["m2"] = grouped.var(ddof=0) * stats["count"]
+            self.moments_ = merge_moments(getattr(self, "moments_", None), stats)
+        else:
+            # medians need every value of a group, only the keys and the column are kept
+            part = pd.concat(keys + [values.rename(self.column)], axis=1)
+            self.parts_ = getattr(self, "parts_", []) + [part]
+
+        self.stats_ = None
+        return self
+
+    def fit(
+        self, data: t.Union[pd.DataFrame, t.Iterable[pd.DataFrame]]
+    ) -> "OutlierTagger":
+        """Compute the group statistics of a dataframe or of an iterable of chunks."""
+
+        self.moments_, self.parts_ = None, []
+        chunks = [data] if isinstance(data, pd.DataFrame) else data
+        for chunk in chunks:
+            self.partial_fit(chunk)
+        self._statistics()
+        return self
+
+    def _statistics(self) -> pd.DataFrame:
+        if getattr(self, "stats_", None) is not None:
+            return self.stats_
+
+        if self.method == "zscore":
+            moments = self.moments_
+            std = np.sqrt(moments["m2"] / (moments["count"] - 1))
+            self.stats_ = pd.DataFrame({"center": moments["mean"], "spread": std})
+        else:
+            parts = pd.concat(self.parts_, ignore_index=True)
+            keys = [parts[key] for key in GROUPINGS[self.groups]]
+            grouped = parts[self.column].groupby(keys, observed=True)
+            deviation = (parts[self.column] - grouped.transform("median")).abs()
+            spread = deviation.groupby(keys, observed=True).median()
+            self.stats_ = pd.DataFrame(
+                {"center": grouped.median(), "spread": MAD_SCALE * spread}
+            )
+        return self.stats_
+
+    def transform(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Tag a dataframe or a chunk with the fitted group statistics."""
+
+        stats = self._statistics()
+        index = pd.MultiIndex.from_arrays(self._keys(data))
+        stats = stats.reindex(index)
+        return self._tag(data, stats["center"].to_numpy(), stats["spread"].to_numpy())
+
+
+def merge_moments(
+    previous: t.Optional[pd.DataFrame], current: pd.DataFrame
+) -> pd.DataFrame:
+    """Merge the count, mean and sum of squared deviations by group of two sets."""
+
+    if previous is None:
+        return current
+
+    index = previous.index.union(current.index)
+    a = previous.reindex(index).fillna({"count": 0, "mean": 0, "m2": 0})
+    b = current.reindex(index).fillna({"count": 0, "mean": 0, "m2": 0})
+
+    count = a["count"] + b["count"]
+    delta = b["mean"] - a["mean"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = a["mean"] + delta * b["count"] / count
+        m2 = a["m2"] + b["m2"] + delta ** 2 * a["count"] * b["count"] / count
+
+    return pd.DataFrame({"count": count, "mean": mean, "m2": m2})
@@ -1,8 +1,16 @@
 import pandas as pd
 
+from attendance_model import __version__ as _version
 from attendance_model.config.core import config
 from attendance_model.pipeline import freq_pipeline
-from attendance_model.processing.data_manager import load_dataset, save_pipeline
+from attendance_model.processing.data_manager import (
+    STATISTICS_STEP,
+    load_dataset,
+    load_pipeline,
+    save_pipeline,
+    save_statistics,
+)
+from attendance_model.processing.outliers import OutlierTagger
 
 
 def timeseries_train_test_split(data, split_date):
@@ -32,52 +40,19 @@ def zscore_outliers(data, column, n):
     Return two boolean columns : upper_outlier and lower_outlier
     """
 
-    outliers = data[(data[column] != 0)]
-
-    # we aggregate value by cantine and annee in order to have
+    # we compare values by cantine and annee in order to have
     # a meaningfull outlier detection system and compare what's comparable
-    outliers = outliers.groupby(["cantine_nom", "annee_scolaire"])
-    outliers = outliers[column].agg(["mean", "std"])
-
-    outliers["lower_bound"] = outliers["mean"] - (n * outliers["std"])
-    outliers["upper_bound"] = outliers["mean"] + (n * outliers["std"])
-
-    data = data.merge(
-        outliers,
-        left_on=["cantine_nom", "annee_scolaire"],
-        right_index=True,
-        how="left",
-    )
-
-    data["upper_outlier"] = data[column] > data["upper_bound"]
-    data["lower_outlier"] = data[column] < data["lower_bound"]
-
-    data.drop(["upper_bound", "lower_bound", "mean", "std"], axis=1, inplace=True)
-
-    return data
+    return OutlierTagger(column, n=n, groups="canteen_year").fit_transform(data)
 
 
 def run_training() -> None:
     """Train the attendance model."""
 
-    # read data
-    data = load_dataset(file_name=config.app_config.data_file)
-
-    # here i consider as an outlier any data point that sits
-    # 2 std away from the mean, this rigourous choice is based on the fact
-    # that Nantes metropole wants a model to predict "normal periods" first
-    # most of the zeros are due to mistakes and are not meaningful values
-    # strikes are not predictible by nature
-    data = zscore_outliers(data, config.model_config.target, 2)
-    data = data.loc[
-        (data["greve"] != 1)
-        & (data["reel"] != 0)
-        & (data["upper_outlier"] != 1)
-        & (data["lower_outlier"] != 1)
-    ]
-    data.drop(["greve", "upper_outlier", "lower_outlier"], axis=1, inplace=True)
-
-    data = data.dropna(axis=0, subset=[config.model_config.target])
+    # read the training set materialized in the datawarehouse: the ETL leaves out
+    # strikes, which are not predictible by nature, zeros, which are mostly mistakes,
+    # and outliers, any data point that sits 2 std away from the mean of its canteen
+    # and school year, as Nantes metropole wants a model to predict "normal periods" first
+    data = load_dataset(file_name=config.app_config.data_file, training=True)
 
     # divide train and test
     X_train, y_train, X_test, y_test = timeseries_train_test_split(
@@ -96,5 +71,38 @@ def run_training() -> None:
     save_pipeline(pipeline_to_persist=freq_pipeline)
 
 
+def run_statistics_update() -> None:
+    """Fold the attendances known since the training into the statistical features."""
+
+    pipeline = load_pipeline(
+        file_name=f"{config.app_config.pipeline_save_file}{_version}.pkl"
+    )
+    statistics = pipeline.named_steps[STATISTICS_STEP]
+    if getattr(statistics, "until_", None) is None:
+        raise ValueError(
+            "the statistics of the persisted pipeline can't be updated, "
+            "it should be trained again"
+        )
+
+    # attendances are daily, the new ones start the day after the last one folded
+    data = load_dataset(
+        file_name=config.app_config.data_file,
+        training=True,
+        start_date=statistics.until_ + pd.Timedelta(days=1),
+    )
+    if data.empty:
+        return
+
+    # same target transform and date features as the training
+    y = data.pop(config.model_config.target) ** (1 / 2)
+    X = pipeline.named_steps["date_features"].transform(data)
+    statistics.update(X, y)
+
+    print(f"Statistics updated with {len(data)} rows up to {statistics.until_}")
+
+    # persist the refreshed statistics next to the trained model
+    save_statistics(pipeline_to_persist=pipeline)
+
+
 if __name__ == "__main__":
     run_training()
@@ -0,0 +1,88 @@
+import pandas as pd
+
+from attendance_model.config.core import config
+from attendance_model.processing.data_manager import (
+    build_query,
+    iter_dataset,
+    load_dataset,
+)
+
+
+def test_build_query_skips_unused_joins():
+
+    query, params = build_query(columns=["date", "reel"], exclude={"greve": 1})
+
+    # only the dimension holding the filtered column is joined
+    assert "Dim_evenement" in query
+    assert "Dim_site" not in query
+    assert "Dim_temporelle" not in query
+    assert "Dim_menu" not in query
+    assert params == [1]
+
+
+def test_load_dataset_pushdown(sample_input_data):
+
+    canteen = sample_input_data["cantine_nom"].iat[0]
+
+    data = load_dataset(
+        file_name=config.app_config.data_file,
+        columns=["date", "cantine_nom", "reel", "greve"],
+        start_date=config.model_config.split_date,
+        canteens=[canteen],
+        exclude={"greve": 1, config.model_config.target: 0},
+        not_null=[config.model_config.target],
+    )
+
+    # only the requested rows and columns are read from the datawarehouse
+    assert list(data.columns) == ["date", "cantine_nom", "reel", "greve"]
+    assert (data["cantine_nom"] == canteen).all()
+    assert (data["date"] >= config.model_config.split_date).all()
+    assert (data["greve"] != 1).all()
+    assert (data["reel"] != 0).all()
+    assert data["reel"].notnull().all()
+
+
+def test_iter_dataset_batches():
+
+    columns = ["date", "cantine_nom", "reel"]
+    batches = list(
+        iter_dataset(
+            file_name=config.app_config.data_file, columns=columns, batch_size=1000
+        )
+    )
+    data = load_dataset(file_name=config.app_config.data_file, columns=columns)
+
+    # batches are typed, share their categories and add up to the whole dataset
+    assert all(len(batch) <= 1000 for batch in batches)
+    assert len({batch["cantine_nom"].dtype for batch in batches}) == 1
+    assert batches[0]["date"].dtype == "datetime64[ns]"
+    streamed = pd.concat(batches, ignore_index=True)
+    pd.testing.assert_frame_equal(
+        streamed.astype({"cantine_nom": object}), data, check_exact=True
+    )
+
+
+def test_load_dataset_training(sample_input_data):
+
+    data = load_dataset(file_name=config.app_config.data_file, training=True)
+
+    # the materialized training set only holds days with a known attendance
+    assert "greve" not in data.columns
+    assert data["reel"].notnull().all()
+    assert (data["reel"] != 0).all()
+    assert len(data) > len(sample_input_data)
+
+
+def test_load_dataset_cache(tmp_path):
+
+    kwargs = dict(file_name=config.app_config.data_file, training=True)
+    data = load_dataset(cache_dir=None, **kwargs)
+
+    # the first load stores the dataset, the next ones read it back
+    first = load_dataset(cache_dir=tmp_path, **kwargs)
+    assert len(list(tmp_path.iterdir())) == 1
+    first.loc[0, "reel"] = 0
+    cached = load_dataset(cache_dir=tmp_path, **kwargs)
+
+    # a cached dataset is identical and not altered by changes to a loaded copy
+    pd.testing.assert_frame_equal(cached, data, check_exact=True)
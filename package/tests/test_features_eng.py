@@ -1,10 +1,13 @@
 import math
 
+import numpy as np
+
 from attendance_model.config.core import config
 from attendance_model.processing.feature_engineering import (
     DatetimeVariableEstimator,
     NumericalImputer,
     StatisticalVariableEstimator,
+    TargetEncoder,
 )
 
 
@@ -21,11 +24,24 @@ def test_datetime_variable_estimator(sample_input_data):
     # finally, testing that the transformations for that data point are the ones we expect
     assert temp["year"].iat[0] == 2018
     assert temp["day_of_week_sin"].iat[0] == 0.0
-    assert math.isclose(temp["day_of_year_sin"].iat[0], -0.932097, abs_tol=0.1)
-    assert math.isclose(temp["day_of_year_cos"].iat[0], -0.36221, abs_tol=0.1)
+    assert math.isclose(temp["day_of_year_sin"].iat[0], -0.888057, abs_tol=1e-6)
+    assert math.isclose(temp["day_of_year_cos"].iat[0], -0.459733, abs_tol=1e-6)
     assert temp["week"].iat[0] == 36
 
 
+def test_datetime_variable_estimator_batch_invariance(sample_input_data):
+
+    transformer = DatetimeVariableEstimator(date_variable="date")
+    features = ["year", "day_of_week_sin", "day_of_year_sin", "day_of_year_cos"]
+
+    # a date gets the same features in a single row request as in the whole batch
+    batch = transformer.fit_transform(sample_input_data)
+    for i in [0, len(sample_input_data) // 2, len(sample_input_data) - 1]:
+        row = transformer.transform(sample_input_data.iloc[[i]])
+        assert row[features].equals(batch[features].iloc[[i]])
+        assert row["week"].iat[0] == batch["week"].iat[i]
+
+
 def test_statistical_variable_estimator(sample_input_data):
 
     # this test required some variable generated in DatetimeVariableEstimator
@@ -84,3 +100,89 @@ def test_numerical_imputer(sample_input_data):
         .sum()
         == 0
     )
+
+
+def test_statistical_variable_estimator_lookup(sample_input_data):
+
+    X = DatetimeVariableEstimator(date_variable="date").fit_transform(
+        sample_input_data
+    )
+    y = X.pop(config.model_config.target)
+    transformer = StatisticalVariableEstimator(
+        prevision="prevision", effectif="effectif"
+    ).fit(X, y)
+
+    # the fitted statistics are arrays, the training target isn't kept
+    assert not hasattr(transformer, "y")
+    assert transformer.statistics_.shape[0] == len(transformer.features)
+
+    # a canteen and week gets the mean of its yearly frequentation rates
+    temp = transformer.transform(X)
+    rates = (y / X["effectif"]).groupby(
+        [X["cantine_nom"], X["week"], X["annee_scolaire"]]
+    )
+    expected = rates.mean().groupby(level=["cantine_nom", "week"]).mean()
+    canteen, week = X["cantine_nom"].iat[0], X["week"].iat[0]
+    assert math.isclose(temp["freq_reel_%"].iat[0], expected[(canteen, week)])
+
+    # unknown canteens get missing statistics and the input is left untouched
+    X["cantine_nom"] = "unknown"
+    assert transformer.transform(X)["freq_reel_%"].isna().all()
+    assert "freq_reel_%" not in X.columns
+
+
+def test_statistical_variable_estimator_update(sample_input_data):
+
+    X = DatetimeVariableEstimator(date_variable="date").fit_transform(
+        sample_input_data
+    )
+    y = X.pop(config.model_config.target)
+    old = X.index < X.index[len(X) // 2]
+
+    # folding new rows into fitted statistics matches a fit on all the rows
+    fitted = StatisticalVariableEstimator(prevision="prevision", effectif="effectif")
+    fitted.fit(X, y)
+    updated = StatisticalVariableEstimator(prevision="prevision", effectif="effectif")
+    updated.fit(X[old], y[old]).update(X[~old], y[~old])
+
+    assert updated.until_ == fitted.until_ == X.index.max()
+    assert np.allclose(
+        updated.statistics_, fitted.statistics_, rtol=1e-9, equal_nan=True
+    )
+
+
+def test_target_encoder(sample_input_data):
+
+    X = sample_input_data.drop([config.model_config.target], axis=1)
+    y = sample_input_data[config.model_config.target]
+    index = y.index.copy()
+    encoder = TargetEncoder(variables=["cantine_nom"], unknown_value=-1).fit(X, y)
+
+    # canteens are encoded by the rank of their mean attendance
+    temp = encoder.transform(X)
+    ranks = y.groupby(X["cantine_nom"]).mean().sort_values().index
+    assert temp["cantine_nom"].iat[0] == ranks.get_loc(X["cantine_nom"].iat[0])
+
+    # unknown canteens get the fallback and the inputs are left untouched
+    temp = encoder.transform(X.assign(cantine_nom="unknown"))
+    assert (temp["cantine_nom"] == -1).all()
+    assert X["cantine_nom"].dtype == object
+    assert y.index.equals(index)
+    assert not hasattr(encoder, "y")
+
+
+def test_numerical_imputer_owned_input(sample_input_data):
+
+    X = sample_input_data.copy()
+    X.loc[X.index[0], "longitude"] = np.nan
+    imputer = NumericalImputer(variables=["longitude", "latitude"]).fit(X)
+
+    # by default the input is copied and left with its missing values
+    temp = imputer.transform(X)
+    assert temp["longitude"].notnull().all()
+    assert np.isnan(X["longitude"].iat[0])
+
+    # an owned input is imputed in place
+    imputer.set_params(copy=False)
+    assert imputer.transform(X) is X
+    assert X["longitude"].iat[0] == imputer.imputer_dict_["longitude"]
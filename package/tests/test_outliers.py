@@ -0,0 +1,38 @@
+import numpy as np
+
+from attendance_model.config.core import config
+from attendance_model.processing.data_manager import iter_dataset, load_dataset
+from attendance_model.processing.outliers import OutlierTagger
+
+
+def test_outlier_tagger_streamed_fit():
+
+    columns = ["date", "cantine_nom", "annee_scolaire", "reel"]
+    kwargs = dict(file_name=config.app_config.data_file, columns=columns)
+    data = load_dataset(**kwargs)
+    tagged = OutlierTagger("reel").fit_transform(data)
+
+    # the flags are added to a copy, the input frame is left untouched
+    assert list(data.columns) == columns
+    assert tagged["upper_outlier"].dtype == bool
+
+    # statistics merged over streamed batches tag the same rows as a single pass
+    tagger = OutlierTagger("reel").fit(iter_dataset(batch_size=1000, **kwargs))
+    streamed = tagger.transform(data)
+    assert np.array_equal(streamed["upper_outlier"], tagged["upper_outlier"])
+    assert np.array_equal(streamed["lower_outlier"], tagged["lower_outlier"])
+
+
+def test_outlier_tagger_mad_by_week():
+
+    data = load_dataset(
+        file_name=config.app_config.data_file,
+        columns=["date", "cantine_nom", "reel"],
+    )
+    tagged = OutlierTagger("reel", method="mad", groups="canteen_week").fit_transform(
+        data
+    )
+
+    # the week is derived from the date when the dataset doesn't hold it
+    assert "week" not in tagged.columns
+    assert tagged["lower_outlier"].any()